@@ -17,7 +17,14 @@ handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w'
 handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
 logger.addHandler(handler)
 
-bot = commands.Bot(
+class Roxbot(commands.Bot):
+	async def close(self):
+		# Ctrl-C, ;restart and ;shutdown all end up here, so the shared HTTP session is always closed with the bot.
+		await roxbot.http.close()
+		await super().close()
+
+
+bot = Roxbot(
 	command_prefix=roxbot.command_prefix,
 	description=roxbot.__description__,
 	owner_id=roxbot.owner,
@@ -64,16 +71,27 @@ async def on_guild_remove(guild):
 	gs.remove_guild(guild)
 
 
+async def ignore_blacklisted(context):
+	"""Stops blacklisted users' messages from going any further. Stages before this one, like slowmode, still see them."""
+	return context.blacklisted
+
+
+async def process_commands(context):
+	await bot.process_commands(context.message)
+
+
+roxbot.pipeline.register(ignore_blacklisted, order=20)
+roxbot.pipeline.register(process_commands, order=100)
+
+
 @bot.event
 async def on_message(message):
 	"""
-	Checks if the user is blacklisted, if not, process the message for commands as usual.
+	Passes the message through the message pipeline. Cogs add their own stages to it instead of having their own on_message.
 	:param message:
 	:return:
 	"""
-	if roxbot.blacklisted(message.author):
-		return
-	return await bot.process_commands(message)
+	await roxbot.pipeline.run(bot, message)
 
 
 @bot.command()
@@ -112,3 +130,4 @@ if __name__ == "__main__":
 
 	start_time = time.time()
 	bot.run(roxbot.token)
+	gs.flush()
@@ -1,4 +1,4 @@
-from roxbot import checks, http, guild_settings, converters, utils
+from roxbot import checks, http, guild_settings, converters, utils, pipeline
 from roxbot.load_config import *
 from roxbot.logging import log
 from roxbot.utils import blacklisted
@@ -0,0 +1,168 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import datetime
+
+from roxbot import guild_settings
+
+BACKUP_DIR = "roxbot/settings/backups"
+TIME_FORMAT = "%Y%m%d-%H%M%S"
+SNAPSHOT_INTERVAL = 24 * 60 * 60  # Seconds between full snapshots, if anything has changed.
+KEEP_SNAPSHOTS = 14  # Older snapshots, and the deltas that lead up to them, are deleted.
+
+
+def _format_time(timestamp):
+	return datetime.datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)
+
+
+def _parse_time(name):
+	"""Gets the time back out of a snapshot or delta file name."""
+	stamp = name.split("-", 1)[1].split(".")[0]
+	return time.mktime(datetime.datetime.strptime(stamp, TIME_FORMAT).timetuple())
+
+
+class Backups:
+	"""
+	Incremental backups of the guild settings.
+
+	Every change to the settings is appended to a journal as it happens, using the settings change events, so backing up never has to read the settings file.
+	tick() compresses the journal into a delta file and takes a full compressed snapshot every SNAPSHOT_INTERVAL.
+	Only the newest KEEP_SNAPSHOTS snapshots and the deltas after them are kept, so disk use stays bounded.
+	Any point in time that is covered can be rebuilt by loading the snapshot before it and replaying the deltas on top.
+	"""
+	def __init__(self, directory=BACKUP_DIR):
+		self.directory = directory
+		self.journal_path = os.path.join(directory, "journal.jsonl")
+		self.journal = None
+		self.changes = 0  # Changes in the journal that haven't been put in a delta yet.
+		self.changed_since_snapshot = False
+		snapshots = self._files("snapshot")
+		self.last_snapshot = _parse_time(snapshots[-1]) if snapshots else 0
+		if os.path.isfile(self.journal_path) and os.path.getsize(self.journal_path):
+			# Left over from the last time roxbot was running.
+			self.changes = 1
+			self.changed_since_snapshot = True
+
+	def start(self):
+		guild_settings.subscribe(self.record)
+
+	def stop(self):
+		guild_settings.unsubscribe(self.record)
+		self.rotate()
+
+	def _files(self, kind):
+		return sorted(name for name in os.listdir(self.directory) if name.startswith(kind + "-") and name.endswith(".gz"))
+
+	def record(self, guild_id, section, old, new):
+		"""Settings change callback that appends the change to the journal."""
+		if section is None:
+			return  # Whole guild reloads come from restores, which take their own snapshot.
+		if self.journal is None:
+			self.journal = open(self.journal_path, "a")
+		value = None if new is None else guild_settings._encode_section(new)
+		self.journal.write(json.dumps({"time": time.time(), "guild": str(guild_id), "section": section, "value": value}) + "\n")
+		self.journal.flush()
+		self.changes += 1
+		self.changed_since_snapshot = True
+
+	def rotate(self):
+		"""
+		Compresses the journal into a delta file and starts a new journal. Does nothing if there haven't been any changes.
+		:return name of the delta file or None:
+		"""
+		if not self.changes:
+			return None
+		if self.journal is not None:
+			self.journal.close()
+			self.journal = None
+		name = "delta-{}.jsonl.gz".format(_format_time(time.time()))
+		with open(self.journal_path, "rb") as journal, gzip.open(os.path.join(self.directory, name), "wb") as delta:
+			shutil.copyfileobj(journal, delta)
+		os.remove(self.journal_path)
+		self.changes = 0
+		return name
+
+	def snapshot(self):
+		"""
+		Writes a compressed copy of every guild's settings, then removes backups that are past the retention limit.
+		:return name of the snapshot file:
+		"""
+		self.rotate()
+		now = time.time()
+		name = "snapshot-{}.json.gz".format(_format_time(now))
+		with gzip.open(os.path.join(self.directory, name), "wt") as fp:
+			json.dump(guild_settings.dump(), fp)
+		self.last_snapshot = now
+		self.changed_since_snapshot = False
+		self.prune()
+		return name
+
+	def prune(self):
+		snapshots = self._files("snapshot")
+		for name in snapshots[:-KEEP_SNAPSHOTS]:
+			os.remove(os.path.join(self.directory, name))
+		if snapshots:
+			oldest = _parse_time(snapshots[-KEEP_SNAPSHOTS:][0])
+			for name in self._files("delta"):
+				if _parse_time(name) <= oldest:
+					os.remove(os.path.join(self.directory, name))
+
+	def tick(self):
+		"""Should be called every few minutes. Moves the journal into a delta and takes a snapshot if one is due."""
+		self.rotate()
+		if self.changed_since_snapshot and time.time() - self.last_snapshot >= SNAPSHOT_INTERVAL:
+			self.snapshot()
+
+	def restorable(self):
+		"""
+		Returns the range of time that can be restored from.
+		:return (oldest, newest) as timestamps or None if there are no snapshots:
+		"""
+		snapshots = self._files("snapshot")
+		if not snapshots:
+			return None
+		return _parse_time(snapshots[0]), time.time()
+
+	def _entries(self, after):
+		"""Yields journal entries from the deltas and the current journal that may be newer than the given time, oldest first."""
+		for name in self._files("delta"):
+			if _parse_time(name) > after:
+				with gzip.open(os.path.join(self.directory, name), "rt") as delta:
+					for line in delta:
+						yield json.loads(line)
+		if self.journal is not None:
+			self.journal.flush()
+		if os.path.isfile(self.journal_path):
+			with open(self.journal_path, "r") as journal:
+				for line in journal:
+					yield json.loads(line)
+
+	def rebuild(self, when):
+		"""
+		Rebuilds every guild's settings as they were at the given time.
+		:param when: Timestamp to rebuild. :type float:
+		:return settings in the form they are saved in or None if there isn't a snapshot that old: :type dict:
+		"""
+		base = None
+		for name in self._files("snapshot"):
+			if _parse_time(name) <= when:
+				base = name
+		if base is None:
+			return None
+		with gzip.open(os.path.join(self.directory, base), "rt") as fp:
+			config = json.load(fp)
+		base_time = _parse_time(base)
+		for entry in self._entries(base_time):
+			if entry["time"] > when:
+				break
+			if entry["time"] < base_time:
+				continue
+			if entry["value"] is None:
+				config.get(entry["guild"], {}).pop(entry["section"], None)
+				if not config.get(entry["guild"], True):
+					config.pop(entry["guild"])
+			else:
+				config.setdefault(entry["guild"], {})[entry["section"]] = entry["value"]
+		return config
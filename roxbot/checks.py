@@ -3,28 +3,52 @@ from roxbot.load_config import owner
 from roxbot import guild_settings as gs
 
 
+# Guild ID to (admin role IDs, admin and mod role IDs). Built the first time a guild is checked and dropped when its perm_roles change.
+_perm_index = {}
+
+
+def _invalidate_perm_roles(guild_id, section, old, new):
+	_perm_index.pop(guild_id, None)
+
+
+gs.subscribe(_invalidate_perm_roles, "perm_roles")
+
+
+def perm_roles(guild):
+	"""
+	Gets the permission roles for a guild as sets so checks don't need to read the settings every time.
+	:param guild: :type discord.Guild:
+	:return (admin role IDs, admin and mod role IDs): :type tuple(frozenset, frozenset):
+	"""
+	try:
+		return _perm_index[guild.id]
+	except KeyError:
+		roles = gs.get(guild).perm_roles
+		admin = frozenset(roles["admin"])
+		_perm_index[guild.id] = admin, admin.union(roles["mod"])
+		return _perm_index[guild.id]
+
+
+def member_is_admin(member):
+	if member.id == owner:
+		return True
+	admin, _ = perm_roles(member.guild)
+	return not admin.isdisjoint(role.id for role in member.roles)
+
+
+def member_is_admin_or_mod(member):
+	if member.id == owner:
+		return True
+	_, staff = perm_roles(member.guild)
+	return not staff.isdisjoint(role.id for role in member.roles)
+
+
 def is_owner_or_admin():
-	def predicate(ctx):
-		if ctx.author.id == owner:
-			return True
-		else:
-			for role in ctx.author.roles:
-				if role.id in gs.get(ctx.guild).perm_roles["admin"]:
-					return True
-		return False
-	return commands.check(predicate)
+	return commands.check(lambda ctx: member_is_admin(ctx.author))
 
 
 def _is_admin_or_mod(ctx):
-	if ctx.message.author.id == owner:
-		return True
-	else:
-		admin_roles = gs.get(ctx.guild).perm_roles["admin"]
-		mod_roles = gs.get(ctx.guild).perm_roles["mod"]
-		for role in ctx.author.roles:
-			if role.id in mod_roles or role.id in admin_roles:
-				return True
-	return False
+	return member_is_admin_or_mod(ctx.author)
 
 
 def is_admin_or_mod():
@@ -8,16 +8,6 @@ import roxbot
 from roxbot import guild_settings as gs
 
 
-def _is_admin_or_mod(message):
-	if message.author.id == roxbot.owner:
-		return True
-	perm_roles = gs.get(message.channel.guild).perm_roles
-	for role in message.author.roles:
-		if role.id in perm_roles.get("admin") or role.id in perm_roles.get("mod"):
-			return True
-	return False
-
-
 class Admin():
 	"""
 	Admin Commands for those admins
@@ -27,26 +17,30 @@ class Admin():
 		self.slow_mode = False
 		self.slow_mode_channels = {}
 		self.users = {}
+		roxbot.pipeline.register(self.slowmode_stage, order=10)
 
-	async def on_message(self, message):
+	def __unload(self):
+		roxbot.pipeline.unregister(self.slowmode_stage)
+
+	async def slowmode_stage(self, context):
 		# Slow Mode Code
+		if not self.slow_mode or context.is_self:
+			return
+		message = context.message
 		channel = message.channel
 		author = message.author
 
-		if not author == self.bot.user:
-			if (self.slow_mode and channel.id in self.slow_mode_channels) and not _is_admin_or_mod(message):
-				if author.id not in self.users[channel.id]:
-					# If user hasn't sent a message in this channel after slow mode was turned on
-					self.users[channel.id][author.id] = message.created_at
-				else:
-					# Else, check when their last message was and if time is smaller than the timer, delete the message.
-					timer = datetime.timedelta(seconds=self.slow_mode_channels[channel.id])
-					if message.created_at - self.users[channel.id][author.id] < timer:
-						await message.delete()
-					else:
-						self.users[message.channel.id][author.id] = message.created_at
+		if channel.id in self.slow_mode_channels and context.permission < roxbot.pipeline.MOD:
+			if author.id not in self.users[channel.id]:
+				# If user hasn't sent a message in this channel after slow mode was turned on
+				self.users[channel.id][author.id] = message.created_at
 			else:
-				pass
+				# Else, check when their last message was and if time is smaller than the timer, delete the message.
+				timer = datetime.timedelta(seconds=self.slow_mode_channels[channel.id])
+				if message.created_at - self.users[channel.id][author.id] < timer:
+					await message.delete()
+				else:
+					self.users[message.channel.id][author.id] = message.created_at
 
 	@roxbot.checks.is_admin_or_mod()
 	@commands.guild_only()
@@ -104,7 +98,6 @@ class Admin():
 	async def add(self, ctx, user: discord.User=None, *, warning=""):
 		"""Adds a warning to a user."""
 		# Warning in the settings is a dictionary of user ids. The user ids are equal to a list of dictionaries.
-		settings = gs.get(ctx.guild)
 		warning_limit = 2
 		warning_dict = {
 			"warned-by": ctx.author.id,
@@ -113,11 +106,12 @@ class Admin():
 		}
 		user_id = str(user.id)
 
-		if user_id not in settings.warnings:
-			settings.warnings[user_id] = []
+		async with gs.get(ctx.guild).transaction() as settings:
+			if user_id not in settings.warnings:
+				settings.warnings[user_id] = []
 
-		settings.warnings[user_id].append(warning_dict)
-		settings.update(settings.warnings, "warnings")
+			settings.warnings[user_id].append(warning_dict)
+			settings.update(settings.warnings, "warnings")
 
 		amount_warnings = len(settings.warnings[user_id])
 		if amount_warnings > warning_limit:
@@ -155,8 +149,9 @@ class Admin():
 			return await ctx.send("This user doesn't have any warning on record.")
 
 		if not settings.warnings[user_id]:
-			settings.warnings.pop(user_id)
-			settings.update(settings.warnings, "warnings")
+			async with settings.transaction() as transaction:
+				transaction.warnings.pop(user_id, None)
+				transaction.update(transaction.warnings, "warnings")
 		
 		em = discord.Embed(title="Warnings for {}".format(str(user)), colour=roxbot.EmbedColours.pink)
 		em.set_thumbnail(url=user.avatar_url)
@@ -177,17 +172,17 @@ class Admin():
 	async def remove(self, ctx, user: roxbot.converters.UserConverter=None, index=None):
 		"""Removes one or all of the warnings for a user."""
 		user_id = str(user.id)
-		settings = gs.get(ctx.guild)
 
 		if index:
 			try:
 				index = int(index)
 				index -= 1
-				settings.warnings[user_id].pop(index)
-				if not settings.warnings[user_id]:
-					settings.warnings.pop(user_id)
+				async with gs.get(ctx.guild).transaction() as settings:
+					settings.warnings[user_id].pop(index)
+					if not settings.warnings[user_id]:
+						settings.warnings.pop(user_id)
 
-				settings.update(settings.warnings, "warnings")
+					settings.update(settings.warnings, "warnings")
 				return await ctx.send("Removed Warning {} from {}".format(index+1, str(user)))
 
 			except Exception as e:
@@ -201,8 +196,9 @@ class Admin():
 					raise e
 		else:
 			try:
-				settings.warnings.pop(user_id)
-				settings.update(settings.warnings, "warnings")
+				async with gs.get(ctx.guild).transaction() as settings:
+					settings.warnings.pop(user_id)
+					settings.update(settings.warnings, "warnings")
 				return await ctx.send("Removed all warnings for {}".format(str(user)))
 			except KeyError:
 				return await ctx.send("Could not find user in warning list.")
@@ -211,16 +207,17 @@ class Admin():
 	@warn.command()
 	async def prune(self, ctx, dry_run=0):
 		"""Purges banned users from the warn list. Add a 1 at the end to do a dry run."""
-		settings = gs.get(ctx.guild)
-		warnings = settings.warnings.copy()
 		count = 0
-		for ban in await ctx.guild.bans():
-			for user in warnings:
-				if int(user) == ban.user.id:
-					if dry_run == 0:
-						settings.warnings.pop(user)
-					count += 1
-		settings.update(settings.warnings, "warnings")
+		bans = await ctx.guild.bans()
+		async with gs.get(ctx.guild).transaction() as settings:
+			warnings = settings.warnings.copy()
+			for ban in bans:
+				for user in warnings:
+					if int(user) == ban.user.id:
+						if dry_run == 0:
+							settings.warnings.pop(user)
+						count += 1
+			settings.update(settings.warnings, "warnings")
 		return await ctx.send("Purged {} banned users from the warn list.".format(count))
 
 	@commands.has_permissions(kick_members=True)
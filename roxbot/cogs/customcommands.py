@@ -1,32 +1,214 @@
+import re
 import discord
+try:
+	from re import _parser as sre_parse
+except ImportError:  # Before Python 3.11
+	import sre_parse
+from collections import deque
 from discord.ext.commands import group
 
 import roxbot
 
+# "0" are matched against the whole message, "1" need the prefix, "contains" can be anywhere in the message and "regex" are regular expressions.
+TRIGGER_TYPES = ("0", "1", "contains", "regex")
+
+# Python's regex engine backtracks and can't be stopped once it starts, so regex triggers are kept to patterns that can't take long.
+MAX_REGEX_LENGTH = 100
+MAX_REGEX_REPEATS = 2  # Repeats that can match a varying number of times, like * + and {1,5}.
+MAX_REGEX_SUBJECT = 200  # Characters at the start of a message that regex triggers are matched against.
+MAX_REGEX_TRIGGERS = 10  # Per guild, as every one is tried on every message.
+
+
+def _trigger_key(trigger_type, command):
+	# Messages are lowercased before matching. Regex is left alone so things like \S keep working and are matched ignoring case instead.
+	return command if trigger_type == "regex" else command.lower()
+
+
+class TriggerAutomaton:
+	"""
+	Aho-Corasick automaton of the "contains" triggers. Finds a trigger in a message in one pass over the message, however many triggers there are.
+	"""
+	__slots__ = ["goto", "fail", "output"]
+
+	def __init__(self, triggers):
+		self.goto = [{}]
+		self.fail = [0]
+		self.output = [None]  # The trigger that ends at each state, if any.
+		for trigger in triggers:
+			state = 0
+			for char in trigger:
+				if char not in self.goto[state]:
+					self.goto.append({})
+					self.fail.append(0)
+					self.output.append(None)
+					self.goto[state][char] = len(self.goto) - 1
+				state = self.goto[state][char]
+			self.output[state] = trigger
+
+		# Fail links are worked out breadth first so a state's link is always known before its children need it.
+		queue = deque(self.goto[0].values())
+		while queue:
+			state = queue.popleft()
+			for char, child in self.goto[state].items():
+				queue.append(child)
+				fail = self.fail[state]
+				while fail and char not in self.goto[fail]:
+					fail = self.fail[fail]
+				self.fail[child] = self.goto[fail].get(char, 0)
+				if self.output[child] is None:
+					self.output[child] = self.output[self.fail[child]]
+
+	def search(self, text):
+		"""
+		:return The first trigger found in the text or None:
+		"""
+		goto = self.goto
+		fail = self.fail
+		output = self.output
+		state = 0
+		for char in text:
+			while state and char not in goto[state]:
+				state = fail[state]
+			state = goto[state].get(char, 0)
+			if output[state] is not None:
+				return output[state]
+		return None
+
+
+class Matcher:
+	"""
+	A guild's custom commands compiled for matching messages.
+	Exact triggers are dict lookups, "contains" triggers share one automaton and regex triggers are joined into one pattern,
+	so the time to match a message depends on the message and not on how many custom commands the guild has.
+	"""
+	__slots__ = ["prefixed", "exact", "contains", "automaton", "regex", "regex_outputs"]
+
+	def __init__(self, custom_commands):
+		self.prefixed = custom_commands["1"]
+		self.exact = custom_commands["0"]
+		self.contains = custom_commands.get("contains", {})
+		self.automaton = TriggerAutomaton(self.contains) if self.contains else None
+
+		patterns = []
+		self.regex_outputs = {}
+		for pattern, output in custom_commands.get("regex", {}).items():
+			if _regex_error(pattern) is not None or len(patterns) >= MAX_REGEX_TRIGGERS:
+				continue
+			name = "cc{}".format(len(patterns))
+			wrapped = "(?P<{}>{})".format(name, pattern)
+			try:
+				# Checked joined with the others so far, as things like two triggers naming a group the same only fail together.
+				re.compile("|".join(patterns + [wrapped]), re.IGNORECASE)
+			except re.error:
+				continue
+			patterns.append(wrapped)
+			self.regex_outputs[name] = output
+		self.regex = re.compile("|".join(patterns), re.IGNORECASE) if patterns else None
+
+	def match(self, context):
+		"""
+		:param context: :type roxbot.pipeline.MessageContext:
+		:return The output of the matching custom command or None:
+		"""
+		if context.prefixed:
+			return self.prefixed.get(context.invoked)
+		output = self.exact.get(context.content)
+		if output is None and self.automaton is not None:
+			trigger = self.automaton.search(context.content)
+			if trigger is not None:
+				output = self.contains[trigger]
+		if output is None and self.regex is not None:
+			match = self.regex.search(context.content, 0, MAX_REGEX_SUBJECT)
+			if match:
+				# The outer group closes last, so lastgroup is the trigger's group even if the pattern has groups of its own.
+				output = self.regex_outputs[match.lastgroup]
+		return output
+
+
+def _count_repeats(pattern, repeated=False):
+	"""
+	Counts the repeats in a parsed regex that can match a varying number of times.
+	Raises ValueError if one of them is inside another or repeats a |, as those can take exponential time on a message that nearly matches.
+	:param pattern: :type sre_parse.SubPattern:
+	:param repeated: If the pattern is itself inside a repeat.
+	:return: :type int:
+	"""
+	count = 0
+	for op, av in pattern:
+		if isinstance(av, sre_parse.SubPattern):
+			children = [av]
+		else:
+			children = av if isinstance(av, (tuple, list)) else ()
+		if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] != av[1] and av[1] > 1:
+			if repeated:
+				raise ValueError
+			count += 1
+			children, repeated_child = [av[2]], True
+		else:
+			repeated_child = repeated
+			if op == sre_parse.BRANCH and repeated:
+				raise ValueError
+		for child in children:
+			for item in (child if isinstance(child, list) else [child]):
+				if isinstance(item, sre_parse.SubPattern):
+					count += _count_repeats(item, repeated_child)
+	return count
+
+
+def _regex_error(pattern):
+	"""
+	Checks a regex trigger can be used.
+	:return Reason it can't or None if it can: :type str:
+	"""
+	# Group numbers change once the patterns are joined, so backreferences would point at the wrong group.
+	if re.search(r"\\[1-9]|\(\?P=|\(\?\(\d", pattern):
+		return "Regex triggers can't use backreferences or group conditionals."
+	# Flags like (?i) have to be at the start of the whole expression, which a trigger isn't once they are joined.
+	if re.search(r"\(\?[aiLmsux]+\)", pattern):
+		return "Regex triggers can't set flags like (?i) for the whole pattern. Use (?i:...) instead."
+	if re.search(r"\(\?P<cc", pattern):
+		return "Regex triggers can't have groups with names starting with 'cc'."
+	if len(pattern) > MAX_REGEX_LENGTH:
+		return "Regex triggers can't be longer than {} characters.".format(MAX_REGEX_LENGTH)
+	try:
+		# Compiled the way Matcher wraps it, so anything that only breaks once joined is caught here.
+		re.compile("(?P<cc0>{})".format(pattern))
+		repeats = _count_repeats(sre_parse.parse(pattern))
+	except re.error as e:
+		return "That isn't a valid regex: {}".format(e)
+	except ValueError:
+		return "Regex triggers can't repeat something that already repeats or has a | in it."
+	if repeats > MAX_REGEX_REPEATS:
+		return "Regex triggers can't have more than {} of * + or {{n,m}}.".format(MAX_REGEX_REPEATS)
+	return None
+
 
 class CustomCommands():
 	def __init__(self, bot_client):
 		self.bot = bot_client
+		self.matchers = {}
+		roxbot.guild_settings.subscribe(self.on_settings_change, "custom_commands")
+		roxbot.pipeline.register(self.custom_commands, order=30)
 
-	async def on_message(self, message):
-		if isinstance(message.channel, discord.DMChannel):
-			return
-		settings = roxbot.guild_settings.get(message.guild)
-		msg = message.content.lower()
-		channel = message.channel
+	def __unload(self):
+		roxbot.guild_settings.unsubscribe(self.on_settings_change)
+		roxbot.pipeline.unregister(self.custom_commands)
 
-		if roxbot.blacklisted(message.author) or type(message.channel) != discord.TextChannel:
-			return
-		if message.author == self.bot.user:
-			return
+	def on_settings_change(self, guild_id, section, old, new):
+		self.matchers.pop(guild_id, None)
 
-		if msg.startswith(self.bot.command_prefix):
-			if msg.split(self.bot.command_prefix)[1] in settings.custom_commands["1"]:
-				return await channel.send(settings.custom_commands["1"][msg.split(self.bot.command_prefix)[1]])
-		else:
-			for command in settings.custom_commands["0"]:
-				if msg == command:
-					return await channel.send(settings.custom_commands["0"][command])
+	def get_matcher(self, guild):
+		if guild.id not in self.matchers:
+			self.matchers[guild.id] = Matcher(roxbot.guild_settings.get(guild).custom_commands)
+		return self.matchers[guild.id]
+
+	async def custom_commands(self, context):
+		if context.guild is None or context.is_self:
+			return
+		output = self.get_matcher(context.guild).match(context)
+		if output is not None:
+			await context.message.channel.send(output)
+			return True
 
 	@group(pass_context=True, aliases=["cc"])
 	@roxbot.checks.is_owner_or_admin()
@@ -37,12 +219,10 @@ class CustomCommands():
 
 	@custom.command(pass_context=True)
 	async def add(self, ctx, command, output, prefix_required="0"):
-		"""Adds a custom command to the list of custom commands."""
-		settings = roxbot.guild_settings.get(ctx.guild)
-		command = command.lower()
+		"""Adds a custom command to the list of custom commands.
+		prefix_required can be 0 (no prefix), 1 (needs the prefix), contains (anywhere in a message) or regex."""
+		command = _trigger_key(prefix_required, command)
 		output = output
-		zero = settings.custom_commands["0"]
-		one = settings.custom_commands["1"]
 
 		if ctx.message.mentions or ctx.message.mention_everyone or ctx.message.role_mentions:
 			return await ctx.send("Custom Commands cannot mention people/roles/everyone.")
@@ -50,53 +230,58 @@ class CustomCommands():
 			return await ctx.send("The output is too long")
 		elif command in self.bot.commands and prefix_required == "1":
 			return await ctx.send("This is already the name of a built in command.")
-		elif command in zero or command in one:
-			return await ctx.send("Custom Command already exists.")
-		elif prefix_required != "1" and prefix_required != "0":
+		elif prefix_required not in TRIGGER_TYPES:
 			return await ctx.send("No prefix setting set.")
 		elif len(command.split(" ")) > 1 and prefix_required == "1":
 			return await ctx.send("Custom commands with a prefix can only be one word with no spaces.")
+		elif prefix_required == "regex" and _regex_error(command):
+			return await ctx.send(_regex_error(command))
 
-		settings.custom_commands[prefix_required][command] = output
-		settings.update(settings.custom_commands, "custom_commands")
+		async with roxbot.guild_settings.get(ctx.guild).transaction() as settings:
+			cc = settings.custom_commands
+			if any(command in cc[trigger_type] for trigger_type in TRIGGER_TYPES):
+				error = "Custom Command already exists."
+			elif prefix_required == "regex" and len(cc["regex"]) >= MAX_REGEX_TRIGGERS:
+				error = "A server can only have {} regex custom commands.".format(MAX_REGEX_TRIGGERS)
+			else:
+				error = None
+				cc[prefix_required][command] = output
+				settings.update(cc, "custom_commands")
+		if error:
+			return await ctx.send(error)
 		return await ctx.send("{} has been added with the output: '{}'".format(command, output))
 
 	@custom.command(pass_context=True)
 	async def edit(self, ctx, command, edit):
 		""""Edits an existing custom command."""
-		settings = roxbot.guild_settings.get(ctx.guild)
-		zero = settings.custom_commands["0"]
-		one = settings.custom_commands["1"]
-
 		if ctx.message.mentions or ctx.message.mention_everyone or ctx.message.role_mentions:
 			return await ctx.send("Custom Commands cannot mention people/roles/everyone.")
 
-		if command in zero:
-			settings.custom_commands["0"][command] = edit
-			settings.update(settings.custom_commands, "custom_commands")
-			return await ctx.send("Edit made. {} now outputs {}".format(command, edit))
-		elif command in one:
-			settings.custom_commands["1"][command] = edit
-			settings.update(settings.custom_commands, "custom_commands")
-			return await ctx.send("Edit made. {} now outputs {}".format(command, edit))
-		else:
-			return await ctx.send("That Custom Command doesn't exist.")
+		async with roxbot.guild_settings.get(ctx.guild).transaction() as settings:
+			for trigger_type in TRIGGER_TYPES:
+				if command in settings.custom_commands[trigger_type]:
+					settings.custom_commands[trigger_type][command] = edit
+					settings.update(settings.custom_commands, "custom_commands")
+					message = "Edit made. {} now outputs {}".format(command, edit)
+					break
+			else:
+				message = "That Custom Command doesn't exist."
+		return await ctx.send(message)
 
 	@custom.command(pass_context=True)
 	async def remove(self, ctx, command):
 		""""Removes a custom command."""
-		settings = roxbot.guild_settings.get(ctx.guild)
-		command = command.lower()
-		if command in settings.custom_commands["1"]:
-			settings.custom_commands["1"].pop(command)
-			settings.update(settings.custom_commands, "custom_commands")
-			return await ctx.send("Removed {} custom command".format(command))
-		elif command in settings.custom_commands["0"]:
-			settings.custom_commands["0"].pop(command)
-			settings.update(settings.custom_commands, "custom_commands")
-			return await ctx.send("Removed {} custom command".format(command))
-		else:
-			return await ctx.send("Custom Command doesn't exist.")
+		async with roxbot.guild_settings.get(ctx.guild).transaction() as settings:
+			for trigger_type in TRIGGER_TYPES:
+				key = _trigger_key(trigger_type, command)
+				if key in settings.custom_commands[trigger_type]:
+					settings.custom_commands[trigger_type].pop(key)
+					settings.update(settings.custom_commands, "custom_commands")
+					message = "Removed {} custom command".format(key)
+					break
+			else:
+				message = "Custom Command doesn't exist."
+		return await ctx.send(message)
 
 	@custom.command(pass_context=True)
 	async def list(self, ctx, debug="0"):
@@ -107,6 +292,8 @@ class CustomCommands():
 		cc = settings.custom_commands
 		listzero = ""
 		listone = ""
+		listcontains = ""
+		listregex = ""
 
 		for command in cc["0"]:
 			if debug == "1":
@@ -116,6 +303,14 @@ class CustomCommands():
 			if debug == "1":
 				command += " - {}".format(cc["1"][command])
 			listone = listone + "- " + command + "\n"
+		for command in cc["contains"]:
+			if debug == "1":
+				command += " - {}".format(cc["contains"][command])
+			listcontains = listcontains + "- " + command + "\n"
+		for command in cc["regex"]:
+			if debug == "1":
+				command += " - {}".format(cc["regex"][command])
+			listregex = listregex + "- " + command + "\n"
 		if not listone:
 			listone = "There are no commands setup.\n"
 		if not listzero:
@@ -126,6 +321,10 @@ class CustomCommands():
 		em = discord.Embed(title="Here is the list of Custom Commands", color=roxbot.EmbedColours.pink)
 		em.add_field(name="Commands that require Prefix:", value=listone, inline=False)
 		em.add_field(name="Commands that don't:", value=listzero, inline=False)
+		if listcontains:
+			em.add_field(name="Commands that can be anywhere in a message:", value=listcontains, inline=False)
+		if listregex:
+			em.add_field(name="Regex commands:", value=listregex, inline=False)
 		return await ctx.send(embed=em)
 
 
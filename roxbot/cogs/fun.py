@@ -7,8 +7,6 @@ from discord import Embed
 from discord.ext import commands
 from discord.ext.commands import bot
 
-import aiohttp
-
 import roxbot
 
 TITLE_QUERY_URL="http://www.explainxkcd.com/wiki/api.php?format=json&action=query&redirects&titles={}"
@@ -32,11 +30,10 @@ async def xkcd_lookup_title(title):
 		return None
 
 async def random_xkcd():
-	async with aiohttp.ClientSession() as session:
-		async with session.get(RANDOM_URL, allow_redirects=False) as resp:
-			comic_url = resp.headers["Location"]
-			num = comic_url.split("/")[-2] # there's always a trailing / so it's the 2nd last segment
-			return await xkcd_lookup_num(num)
+	async with roxbot.http.request("GET", RANDOM_URL, allow_redirects=False) as resp:
+		comic_url = resp.headers["Location"]
+	num = comic_url.split("/")[-2] # there's always a trailing / so it's the 2nd last segment
+	return await xkcd_lookup_num(num)
 
 
 class Fun:
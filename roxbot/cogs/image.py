@@ -1,10 +1,11 @@
-import os
-import math
+import io
+import hashlib
 import roxbot
 import discord
-from PIL import Image, ImageEnhance
 from discord.ext import commands
 
+from roxbot import imaging
+
 
 class PrideFlags:
 	"""Class to produce pride flags for the filters in Roxbot."""
@@ -86,6 +87,12 @@ class PrideFlags:
 class CustomCommands:
 	def __init__(self, bot_client):
 		self.bot = bot_client
+		self.service = imaging.ImageService()
+		self.sources = imaging.SourceCache()
+		self.outputs = imaging.OutputCache(directory=imaging.OUTPUT_CACHE_DIR if roxbot.persist_image_cache else None)
+
+	def __unload(self):
+		self.service.shutdown()
 
 	@staticmethod
 	def image_lookup(message):
@@ -93,43 +100,41 @@ class CustomCommands:
 			if message.attachments[0].height:  # Check if attachment is image
 				return message.attachments[0].url
 		except IndexError:
-			return message.author.avatar_url_as(format="png")
-
-	@staticmethod
-	async def flag_filter(name, flag, url):
+			return message.author.avatar_url_as(static_format="png")
+
+	async def get_source(self, url):
+		"""Downloads and decodes the image at the url, unless it has been recently."""
+		source = self.sources.get_url(url)
+		if source is None:
+			data = (await roxbot.http.download_bytes(url)).getvalue()
+			digest = hashlib.sha1(data).hexdigest()
+			source = self.sources.get(digest)
+			if source is None:
+				source = imaging.Source(digest, *await self.service.run(imaging.decode, data))
+			self.sources.put(url, source)
+		return source
+
+	async def apply_filter(self, url, job, *params):
+		"""
+		Runs an imaging job on the image at the url, or gets the result from the last time it was run on the same image.
+		:return: The encoded result :type bytes:
+		"""
+		# If the url was seen recently, the result may be cached even if the image itself isn't any more.
+		digest = self.sources.digest_for(url)
+		output = self.outputs.get((digest, job.__name__, params)) if digest else None
+		if output is None:
+			source = await self.get_source(url)
+			key = (source.digest, job.__name__, params)
+			output = self.outputs.get(key)
+			if output is None:
+				output = await self.service.run(job, source, *params)
+				self.outputs.put(key, output)
+		return output
+
+	async def flag_filter(self, name, flag, url):
 		"""At the moment, can only make horizontal stripe flags"""
-
-		f = 'filter_{}.png'.format(name)
-
-		await roxbot.http.download_file(url, f)
-
-		ava = Image.open(f)
-		top = 0  # In the box we use, top is used to define which part of the image we are working on
-		bottom = 0  # And bottom defines the height. That should help you visualise why I increment the values the way I do
-
-		for x, colour in enumerate(flag.colours):
-			# Grab the next slice of the images height and width
-			# we use math.ceil here to avoid rounding errors when converting float to int
-			height = int(math.ceil(ava.height * flag.ratio[x]))
-			width = ava.width
-			bottom += height
-			box = (0, top, width, bottom)
-
-			# Make the colour block and the transparency mask at the slice size. Then crop the next part of the image
-			row = Image.new('RGB', (width, height), colour)
-			mask = Image.new('RGBA', (width, height), (0, 0, 0, 123))
-			crop = ava.crop(box)
-
-			# Combine all three and paste it back into original image
-			part = Image.composite(crop, row, mask)
-			ava.paste(part, box)
-
-			top += height
-
-		os.remove(f)
-		ava.save(f)
-		file = discord.File(f)
-		return file
+		output = await self.apply_filter(url, imaging.flag_filter, flag.colours, flag.ratio, roxbot.image_upload_budget)
+		return discord.File(io.BytesIO(output), 'filter_{}.{}'.format(name, imaging.extension(output)))
 
 	@commands.group(case_insensitive=True)
 	async def pride(self, ctx):
@@ -145,7 +150,6 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("lgbt", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@pride.command(aliases=["transgender"])
 	async def trans(self, ctx, image: roxbot.converters.AvatarURL=None):
@@ -156,7 +160,6 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("trans", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@pride.command(aliases=["nonbinary", "nb"])
 	async def enby(self, ctx, image: roxbot.converters.AvatarURL=None):
@@ -167,7 +170,6 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("nb", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@pride.command(aliases=["bisexual"])
 	async def bi(self, ctx, image: roxbot.converters.AvatarURL=None):
@@ -178,7 +180,6 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("bi", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@pride.command(aliases=["genderqueer"])
 	async def gq(self, ctx, image: roxbot.converters.AvatarURL=None):
@@ -189,7 +190,6 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("gq", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@pride.command(aliases=["pansexual"])
 	async def pan(self, ctx, image: roxbot.converters.AvatarURL=None):
@@ -200,7 +200,6 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("pan", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@pride.command(aliases=["asexual"])
 	async def ace(self, ctx, image: roxbot.converters.AvatarURL=None):
@@ -211,53 +210,14 @@ class CustomCommands:
 		async with ctx.typing():
 			file = await self.flag_filter("pan", flag, image)
 		await ctx.send(file=file)
-		os.remove(file.filename)
 
 	@commands.command()
 	async def deepfry(self, ctx, image: roxbot.converters.AvatarURL=None):
 		if not image:
 			image = self.image_lookup(ctx.message)
-		filename = await roxbot.http.download_file(image)
-
 		async with ctx.typing():
-			# Convert to jpg
-			if filename.split(".")[-1] != "jpg":
-				jpg_name = filename.split(".")[0] + ".jpg"
-				img = Image.open(filename)
-				img = img.convert(mode="RGB")
-				img.save(jpg_name)
-				os.remove(filename)
-			else:
-				jpg_name = filename
-
-			# Brightness Enhance
-			img = Image.open(jpg_name)
-			ehn = ImageEnhance.Brightness(img)
-			ehn.enhance(1.25).save(jpg_name)
-
-			# Contrast Enhance
-			img = Image.open(jpg_name)
-			ehn = ImageEnhance.Contrast(img)
-			ehn.enhance(1.5).save(jpg_name)
-
-			# Sharpness Enhance
-			img = Image.open(jpg_name)
-			ehn = ImageEnhance.Sharpness(img)
-			ehn.enhance(20).save(jpg_name)
-
-			# Saturation Enhance
-			img = Image.open(jpg_name)
-			ehn = ImageEnhance.Color(img)
-			ehn.enhance(2).save(jpg_name)
-
-			# JPG-fy image
-			for x in range(10):
-				img = Image.open(jpg_name)
-				img = img.convert(mode="RGB")
-				img.save(jpg_name)
-
-			await ctx.send(file=discord.File(jpg_name))
-		os.remove(jpg_name)
+			output = await self.apply_filter(image, imaging.deepfry, roxbot.image_upload_budget)
+			await ctx.send(file=discord.File(io.BytesIO(output), "deepfry.{}".format(imaging.extension(output))))
 
 
 def setup(bot_client):
@@ -16,14 +16,27 @@ class NFSW():
 	def __init__(self, bot_client):
 		self.bot = bot_client
 		self.cache = {}
+		self.tag_blacklists = {}
 		for guild in self.bot.guilds:
 			self.cache[guild.id] = []
+		gs.subscribe(self.on_settings_change, "nsfw")
+
+	def __unload(self):
+		gs.unsubscribe(self.on_settings_change)
+
+	def on_settings_change(self, guild_id, section, old, new):
+		self.tag_blacklists.pop(guild_id, None)
+
+	def get_tag_blacklist(self, guild):
+		if guild.id not in self.tag_blacklists:
+			self.tag_blacklists[guild.id] = tag_blacklist(guild)
+		return self.tag_blacklists[guild.id]
 
 	@roxbot.checks.is_nfsw_enabled()
 	@bot.command(hidden=True)
 	async def gelbooru_clone(self, ctx, base_url, post_url, tags):
 		limit = 150
-		tags = tags + tag_blacklist(ctx.guild)
+		tags = tags + self.get_tag_blacklist(ctx.guild)
 		url = base_url + tags + '&limit=' + str(limit)
 
 		posts = await roxbot.http.api_request(url)
@@ -36,15 +36,15 @@ class Twitch():
 		"""Enables the twitch shilling whitelist. Repeat the command to disable.
 		Usage:
 			;whitelist enable"""
-		settings = roxbot.guild_settings.get(ctx.guild)
-		if not settings.twitch["whitelist"]["enabled"]:
-			settings.twitch["whitelist"]["enabled"] = 1
+		async with roxbot.guild_settings.get(ctx.guild).transaction() as settings:
+			if not settings.twitch["whitelist"]["enabled"]:
+				settings.twitch["whitelist"]["enabled"] = 1
+				message = "Whitelist for Twitch shilling has been enabled."
+			else:
+				settings.twitch["whitelist"]["enabled"] = 0
+				message = "Whitelist for Twitch shilling has been disabled."
 			settings.update(settings.twitch, "twitch")
-			return await ctx.send("Whitelist for Twitch shilling has been enabled.")
-		else:
-			settings.twitch["whitelist"]["enabled"] = 0
-			settings.update(settings.twitch, "twitch")
-			return await ctx.send("Whitelist for Twitch shilling has been disabled.")
+		return await ctx.send(message)
 
 	@whitelist.command()
 	async def edit(self, ctx, option, mentions=None):
@@ -53,7 +53,6 @@ class Twitch():
 		# TODO: This is all horribly outdated useage and needs to be rewritten.
 
 		whitelist_count = 0
-		settings = roxbot.guild_settings.get(ctx.guild)
 
 		if not ctx.message.mentions and option != 'list':
 			return await ctx.send("You haven't mentioned anyone to whitelist.")
@@ -61,23 +60,25 @@ class Twitch():
 		if option not in ['+', '-', 'add', 'remove', 'list']:
 			return await ctx.send('Invalid option "%s" specified, use +, -, add, or remove' % option, expire_in=20)
 
-		if option in ['+', 'add']:
-			for user in ctx.message.mentions:
-				settings.twitch["whitelist"]["list"].append(user.id)
-				whitelist_count += 1
-			settings.update(settings.twitch, "twitch")
-			return await ctx.send('{} user(s) have been added to the whitelist'.format(whitelist_count))
-
-		elif option in ['-', 'remove']:
-			for user in ctx.message.mentions:
-				if user.id in settings.twitch["whitelist"]["list"]:
-					settings.twitch["whitelist"]["list"].remove(user.id)
+		async with roxbot.guild_settings.get(ctx.guild).transaction() as settings:
+			if option in ['+', 'add']:
+				for user in ctx.message.mentions:
+					settings.twitch["whitelist"]["list"].append(user.id)
 					whitelist_count += 1
-			settings.update(settings.twitch, "twitch")
-			return await ctx.send('{} user(s) have been removed to the whitelist'.format(whitelist_count))
-
-		elif option == 'list':
-			return await ctx.send(settings.twitch["whitelist"]["list"])
+				settings.update(settings.twitch, "twitch")
+				message = '{} user(s) have been added to the whitelist'.format(whitelist_count)
+
+			elif option in ['-', 'remove']:
+				for user in ctx.message.mentions:
+					if user.id in settings.twitch["whitelist"]["list"]:
+						settings.twitch["whitelist"]["list"].remove(user.id)
+						whitelist_count += 1
+				settings.update(settings.twitch, "twitch")
+				message = '{} user(s) have been removed to the whitelist'.format(whitelist_count)
+
+			elif option == 'list':
+				message = settings.twitch["whitelist"]["list"]
+		return await ctx.send(message)
 
 
 def setup(bot_client):
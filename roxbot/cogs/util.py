@@ -25,15 +25,22 @@ class Util():
 		if not user:
 			user = ctx.author
 
-		url = user.avatar_url_as(static_format="png")
-		if url.split(".")[-1] == "gif":
+		# Discord resizes and encodes avatars for us, so if the biggest is over budget just ask it for a smaller one.
+		for size in (1024, 512, 256, 128):
+			url = user.avatar_url_as(static_format="png", size=size)
+			try:
+				avatar = await roxbot.http.download_bytes(url, max_size=roxbot.image_upload_budget)
+				break
+			except roxbot.http.DownloadTooLarge:
+				continue
+		else:
+			return await ctx.send("That avatar is too big to upload.")
+
+		if url.split(".")[-1].startswith("gif"):
 			avaimg = '{0.name}.gif'.format(user)
 		else:
 			avaimg = '{0.name}.png'.format(user)
-
-		await roxbot.http.download_file(url, avaimg)
-		await ctx.send(file=discord.File(avaimg))
-		os.remove(avaimg)
+		await ctx.send(file=discord.File(avatar, avaimg))
 
 	@bot.command()
 	async def info(self, ctx, member: discord.Member = None):
@@ -157,14 +164,14 @@ class Util():
 
 			print(site)
 			for attachment in ctx.message.attachments:
-				name = attachment.url.split("/")[-1]
 				# Download File
-				await roxbot.http.download_file(attachment.url, name)
-
-				response = await roxbot.http.upload_file(site+"upload.php", name)
+				name = await roxbot.http.download_file(attachment.url, max_size=attachment.size)
+				try:
+					response = await roxbot.http.upload_file(site+"upload.php", name)
+				finally:
+					os.remove(name)
 				file_name_1 = response["files"][0]["url"].replace("\\", "")
 				urls.append(file_name_1)
-				os.remove(name)
 			msg = "".join(urls)
 			return await ctx.send(msg)
 		else:
@@ -11,25 +11,17 @@ from roxbot import guild_settings
 
 
 def _clear_cache():
-	"""Clears the cache folder for the music bot. Ignores the ".gitignore" file to avoid deleting versioned files."""
+	"""Clears the cache folder for the music bot. Ignores the ".gitignore" file to avoid deleting versioned files, and folders other cogs cache in."""
 	for file in os.listdir("roxbot/cache"):
-		if file != ".gitignore":
+		if file != ".gitignore" and os.path.isfile("roxbot/cache/{}".format(file)):
 			os.remove("roxbot/cache/{}".format(file))
 
 
 def volume_perms():
 	def predicate(ctx):
 		gs = guild_settings.get(ctx.guild)
-		if gs.voice["need_perms"]:  # Had to copy the admin or mod code cause it wouldn't work ;-;
-			if ctx.message.author.id == roxbot.owner:
-				return True
-			else:
-				admin_roles = gs.perm_roles["admin"]
-				mod_roles = gs.perm_roles["mod"]
-				for role in ctx.author.roles:
-					if role.id in mod_roles or role.id in admin_roles:
-						return True
-			return False
+		if gs.voice["need_perms"]:
+			return roxbot.checks.member_is_admin_or_mod(ctx.author)
 		else:
 			return True
 	return commands.check(predicate)
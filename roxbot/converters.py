@@ -49,12 +49,12 @@ class AvatarURL(commands.UserConverter):
 	Will do a user lookup, if that fails, then tries to parse the argument for a link
 	"""
 	async def convert(self, ctx, argument):
-		if any(x in argument.split(".")[-1] for x in ("png", "jpg", "jpeg")):
+		if any(x in argument.split(".")[-1] for x in ("png", "jpg", "jpeg", "gif", "webp")):
 			return argument
 		else:
 			try:
 				user = await super().convert(ctx, argument)
-				return user.avatar_url_as(format="png")
+				return user.avatar_url_as(static_format="png")
 			except:  # Same as above
 				raise commands.BadArgument("No valid image/user given.")
 
@@ -1,4 +1,14 @@
+import re
+import copy
 import json
+import atexit
+import hashlib
+import asyncio
+import traceback
+
+from roxbot import storage
+from roxbot.load_config import settings_backend
+
 # TODO: Make the convert stuff seperate but cant do that now cause it would require how you interact with the guild settings api.
 # Cause a settings dict would be split into two more instead of just the settings.
 
@@ -42,7 +52,9 @@ guild_template = {
 				},
 				"custom_commands": {
 					"0": {},
-					"1": {}
+					"1": {},
+					"contains": {},
+					"regex": {}
 				},
 				"gss": {
 					"log_channel": "",
@@ -67,70 +79,487 @@ guild_template = {
 }
 
 
-def _open_config():
+class Section(object):
 	"""
-	Opens the guild settings file
-	:return settings file: :type dict:
+	Base class for the typed section records that _compile_section builds from guild_template.
+	Records still work like the dicts settings used to be (section["enabled"], .keys(), .items() etc.),
+	but the conversion between the saved strings and the int IDs is worked out once when roxbot is imported instead of on every read.
+	Settings found in saved data that aren't in the template are kept in _extra so they aren't lost.
 	"""
-	with open('roxbot/settings/servers.json', 'r') as config_file:
-		return json.load(config_file)
+	__slots__ = ["_extra"]
+	name = ""
+	keys_ = ()  # Every setting name in template order, including "convert"
+	slots = {}  # Setting name -> slot name
+	types = {}  # Setting name -> type of the value once decoded
+	convert = {}
+	decoders = ()  # (setting name, slot name, decoder) for every setting that can be loaded
+	encoders = ()  # (setting name, slot name, encoder) in template order
+
+	@classmethod
+	def decode(cls, raw):
+		"""
+		Makes a record from the saved form of this section in a single pass. Settings missing from raw are left unset.
+		:param raw: :type dict:
+		:return record:
+		"""
+		record = cls.__new__(cls)
+		for key, slot, decoder in cls.decoders:
+			if key in raw:
+				setattr(record, slot, decoder(raw[key]))
+		record._extra = {key: copy.deepcopy(value) for key, value in raw.items() if key not in cls.slots and key != "convert"}
+		return record
+
+	def encode(self):
+		"""
+		Returns this section in the form it is saved in, with IDs as strings.
+		:return section: :type dict:
+		"""
+		encoded = {}
+		for key, slot, encoder in self.encoders:
+			if key == "convert":
+				encoded[key] = dict(self.convert)
+			elif hasattr(self, slot):
+				encoded[key] = encoder(getattr(self, slot))
+		for key, value in self._extra.items():
+			encoded[key] = copy.deepcopy(value)
+		return encoded
+
+	def copy(self):
+		"""Returns a copy of this record. Lists are copied too so the copy can be edited freely."""
+		record = self.__class__.__new__(self.__class__)
+		for slot in self.slots.values():
+			try:
+				value = getattr(self, slot)
+			except AttributeError:
+				continue
+			setattr(record, slot, value[:] if isinstance(value, list) else value)
+		record._extra = copy.deepcopy(self._extra)
+		return record
+
+	def __deepcopy__(self, memo):
+		return self.copy()
+
+	def __getitem__(self, key):
+		if key == "convert":
+			return self.convert
+		try:
+			slot = self.slots[key]
+		except KeyError:
+			return self._extra[key]
+		try:
+			return getattr(self, slot)
+		except AttributeError:
+			raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key in self.slots:
+			setattr(self, self.slots[key], value)
+		elif key != "convert":
+			self._extra[key] = value
+
+	def __contains__(self, key):
+		return key in self.keys()
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.keys())
+
+	def __eq__(self, other):
+		if isinstance(other, Section):
+			other = dict(other.items())
+		return dict(self.items()) == other
+
+	def __repr__(self):
+		return "<{} {}>".format(self.__class__.__name__, dict(self.items()))
 
+	def keys(self):
+		keys = [key for key in self.keys_ if key == "convert" or hasattr(self, self.slots[key])]
+		return keys + list(self._extra)
 
-def _write_changes(config):
+	def values(self):
+		return [self[key] for key in self.keys()]
+
+	def items(self):
+		return [(key, self[key]) for key in self.keys()]
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+
+def _list_of(func):
+	return lambda values: [func(value) for value in values]
+
+
+def _copy_value(value):
+	return value[:] if isinstance(value, list) else value
+
+
+def _compile_section(name, template):
 	"""
-	Writes given config to disk.
-	:param config: :type dict:
-	:return:
+	Builds a Section subclass for one section of guild_template with a slot for each setting and precomputed decoders and encoders.
+	:param name: Section name :type str:
+	:param template: The section from guild_template :type dict:
+	:return record type:
 	"""
-	with open('roxbot/settings/servers.json', 'w') as conf_file:
-		json.dump(config, conf_file)
+	convert = template["convert"]
+	keys = list(template)
+	slots = {key: re.sub(r"\W", "_", key) for key in keys if key != "convert"}
+	types = {}
+	decoders = []
+	encoders = []
+	for key in keys:
+		if key == "convert":
+			encoders.append((key, None, None))
+			continue
+		default = template[key]
+		if convert.get(key, "bool") != "bool":
+			# Channel, role and user IDs are saved as strings.
+			decoder, encoder = int, str
+			types[key] = int
+		else:
+			decoder, encoder = _copy_value, _copy_value
+			types[key] = type(default)
+		if isinstance(default, list):
+			if decoder is int:
+				decoder, encoder = _list_of(int), _list_of(str)
+			types[key] = list
+		decoders.append((key, slots[key], decoder))
+		encoders.append((key, slots[key], encoder))
+	class_name = "".join(part.title() for part in name.split("_")) + "Section"
+	return type(class_name, (Section,), {
+		"__slots__": list(slots.values()),
+		"name": name,
+		"keys_": tuple(keys),
+		"slots": slots,
+		"types": types,
+		"convert": convert,
+		"decoders": tuple(decoders),
+		"encoders": tuple(encoders)
+	})
+
+
+# Sections without a "convert" dict (custom commands, warnings, etc.) don't need converting and are kept as plain dicts.
+section_types = {name: _compile_section(name, settings) for name, settings in guild_template["example"].items() if "convert" in settings}
+
+
+def _decode_section(section, value):
+	"""
+	Returns a copy of value that is safe to keep in the store. Sections with a record type are turned into records if they aren't already.
+	"""
+	record_type = section_types.get(section)
+	if record_type is None:
+		return copy.deepcopy(value)
+	if isinstance(value, Section):
+		return value.copy()
+	return record_type.decode(value)
+
+
+def _encode_section(value):
+	if isinstance(value, Section):
+		return value.encode()
+	return copy.deepcopy(value)
+
+
+def _decode_guild(settings):
+	return {section: _decode_section(section, value) for section, value in settings.items()}
+
+
+class SettingsStore:
+	"""
+	Process wide store of every guild's settings.
+	The settings are read from the storage backend once, and the decoded settings are served from memory after that.
+	Changes mark the section as dirty and all dirty sections are saved in one batch, either FLUSH_DELAY seconds after the first change or when the bot shuts down.
+	"""
+	FLUSH_DELAY = 5
+
+	def __init__(self, backend=None):
+		self.backend = backend
+		self.guilds = None
+		self.dirty = {}
+		self.removed = set()
+		self.meta = {}
+		self.meta_dirty = False
+		self._encoded = {}
+		self._flush_handle = None
+
+	def load(self):
+		"""Loads (or reloads) every guild's settings from the backend, throwing away anything that hasn't been flushed."""
+		if self.backend is None:
+			self.backend = storage.get_backend(settings_backend)
+		reloading = self.guilds is not None
+		self._encoded, self.meta = self.backend.load()
+		self.guilds = {}
+		for guild_id, settings in self._encoded.items():
+			self.guilds[guild_id] = _decode_guild(settings)
+		self.dirty.clear()
+		self.removed.clear()
+		self.meta_dirty = False
+		if reloading:
+			for guild_id in self.guilds:
+				_publish(int(guild_id), None, None, None)
+
+	def _loaded(self):
+		if self.guilds is None:
+			self.load()
+		return self.guilds
+
+	def __contains__(self, guild_id):
+		return str(guild_id) in self._loaded()
+
+	def __iter__(self):
+		return iter(list(self._loaded()))
+
+	def get(self, guild_id):
+		"""
+		Returns the stored settings for that guild. These are the store's own dicts so should not be changed by the caller.
+		:param guild_id:
+		:return settings: :type dict:
+		"""
+		return self._loaded()[str(guild_id)]
+
+	def set_section(self, guild_id, section, value):
+		self.set_sections(guild_id, {section: value})
+
+	def set_sections(self, guild_id, sections):
+		"""
+		Replaces several sections of one guild at once. All of them are changed before anyone is told about the change.
+		:param guild_id:
+		:param sections: Dict of section names to their new values. :type dict:
+		"""
+		guild = self._loaded()[str(guild_id)]
+		old = {section: guild.get(section) for section in sections}
+		for section, value in sections.items():
+			guild[section] = _decode_section(section, value)
+		self.mark_dirty(guild_id, *sections)
+		for section in sections:
+			_publish(int(guild_id), section, old[section], guild[section])
+
+	def set_guild(self, guild_id, settings):
+		old = self._loaded().get(str(guild_id), {})
+		new = self.guilds[str(guild_id)] = _decode_guild(settings)
+		self.removed.add(str(guild_id))  # Clears out any sections the new settings don't have.
+		self.mark_dirty(guild_id, *settings)
+		for section in list(old) + [section for section in new if section not in old]:
+			_publish(int(guild_id), section, old.get(section), new.get(section))
+
+	def remove_guild(self, guild_id):
+		guild_id = str(guild_id)
+		old = self._loaded().pop(guild_id, {})
+		self.dirty.pop(guild_id, None)
+		self.removed.add(guild_id)
+		self._schedule_flush()
+		for section, value in old.items():
+			_publish(int(guild_id), section, value, None)
+
+	def get_meta(self, key, default=None):
+		self._loaded()
+		return self.meta.get(key, default)
+
+	def set_meta(self, key, value):
+		self._loaded()
+		self.meta[key] = value
+		self.meta_dirty = True
+		self._schedule_flush()
+
+	def mark_dirty(self, guild_id, *sections):
+		self.dirty.setdefault(str(guild_id), set()).update(sections)
+		self._schedule_flush()
+
+	def _schedule_flush(self):
+		if self._flush_handle is not None:
+			return  # A flush is already coming and it will pick this change up too.
+		loop = asyncio.get_event_loop()
+		if loop.is_running():
+			self._flush_handle = loop.call_later(self.FLUSH_DELAY, self.flush)
+		else:
+			self.flush()
+
+	def _encode_dirty(self):
+		"""
+		Converts the dirty sections back into the form they are saved in.
+		:return changed, removed: The dirty sections and removed guilds that still need saving.
+		"""
+		guilds = self._loaded()
+		for guild_id in self.removed:
+			self._encoded.pop(guild_id, None)
+		for guild_id, sections in self.dirty.items():
+			encoded = self._encoded.setdefault(guild_id, {})
+			for section in sections:
+				encoded[section] = _encode_section(guilds[guild_id][section])
+		changed, removed = self.dirty, self.removed
+		self.dirty, self.removed = {}, set()
+		return changed, removed
 
+	def replace(self, config):
+		"""
+		Replaces every guild's settings with the ones given and saves them straight away. Used to restore backups.
+		:param config: Settings for every guild in the form they are saved in. :type dict:
+		"""
+		old = self._loaded()
+		self.removed.update(old)
+		self.guilds = {guild_id: _decode_guild(settings) for guild_id, settings in config.items()}
+		self.dirty = {guild_id: set(settings) for guild_id, settings in self.guilds.items()}
+		# The settings could be from before the template last changed, so error_check() has to look at every guild again.
+		self.meta.pop("schema_version", None)
+		self.meta_dirty = True
+		self.flush()
+		for guild_id in set(old) | set(self.guilds):
+			_publish(int(guild_id), None, None, None)
 
-def backup(config, name):
-	with open('roxbot/settings/backups/{}.json'.format(name), "w") as f:
-		json.dump(config, f)
+	def dump(self):
+		"""
+		Returns every guild's settings in the form they are saved in.
+		:return settings: :type dict:
+		"""
+		changed, removed = self._encode_dirty()
+		if changed or removed:
+			# Put them back so the next flush still saves them.
+			for guild_id, sections in changed.items():
+				self.dirty.setdefault(guild_id, set()).update(sections)
+			self.removed.update(removed)
+		return self._encoded
+
+	def flush(self):
+		"""Saves all dirty sections. Does nothing if nothing has changed."""
+		if self._flush_handle is not None:
+			self._flush_handle.cancel()
+			self._flush_handle = None
+		if self.dirty or self.removed or self.meta_dirty:
+			changed, removed = self._encode_dirty()
+			self.backend.save(self._encoded, changed, removed, self.meta)
+			self.meta_dirty = False
+
+
+_store = SettingsStore()
+atexit.register(_store.flush)
+_subscribers = []
+_locks = {}
+
+
+def subscribe(callback, section=None):
+	"""
+	Registers a function to be called whenever a guild's settings change. Handy for cogs that keep things worked out from the settings,
+	so they only need to redo them for the guild that changed.
+	The callback is called as callback(guild_id, section, old, new). old is None for new sections and new is None for removed ones.
+	section is None when all of a guild's settings were reloaded, like after restoring a backup. old and new belong to the store so must not be changed.
+	:param callback: Normal (not async) function.
+	:param section: Only call back for changes to this section. Changes for every section are sent if not given.
+	:return callback:
+	"""
+	_subscribers.append((callback, section))
+	return callback
+
+
+def unsubscribe(callback):
+	"""Stops a function given to subscribe() from being called. Should be done when a cog is unloaded."""
+	_subscribers[:] = [(func, section) for func, section in _subscribers if func != callback]
+
+
+def _publish(guild_id, section, old, new):
+	for callback, wanted in list(_subscribers):
+		if wanted is None or section is None or wanted == section:
+			try:
+				callback(guild_id, section, old, new)
+			except Exception:
+				traceback.print_exc()
+
+
+def flush():
+	"""Writes any settings changes still waiting in memory to disk. Should be called before the bot shuts down or restarts."""
+	_store.flush()
+
+
+def dump():
+	"""
+	Returns a copy of all guild settings as they would be saved to disk, without reading the settings file.
+	:return settings: :type dict:
+	"""
+	return copy.deepcopy(_store.dump())
+
+
+def restore(config):
+	"""
+	Replaces the settings of every guild with config, which should be in the same form as dump() returns. Saved straight away.
+	error_check() should be run after, as config may be missing guilds or settings added since it was made.
+	:param config: :type dict:
+	"""
+	_store.replace(config)
 
 
 def remove_guild(guild):
-	settings = _open_config()
-	settings.pop(str(guild.id))
-	_write_changes(settings)
+	_store.remove_guild(guild.id)
 
 
 def add_guild(guild):
-	settings = _open_config()
-	settings[str(guild.id)] = guild_template["example"]
-	_write_changes(settings)
+	_store.set_guild(guild.id, guild_template["example"])
+
+
+def schema_version():
+	"""
+	Returns a version string for the current guild_template. It changes whenever a section or setting is added to the template,
+	which tells error_check that the saved settings need scanning again.
+	:return version: :type str:
+	"""
+	shape = {section: sorted(settings) for section, settings in guild_template["example"].items()}
+	return hashlib.sha1(json.dumps(shape, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _migrate_guild(settings, name):
+	"""
+	Works out what is missing from a guild's settings compared to the template. The guild's settings aren't changed.
+	:return fixed sections: Dict of section names to the fixed version of that section. :type dict:
+	"""
+	changed = {}
+	template = guild_template["example"]
+	for cog_setting in template:
+		if cog_setting not in settings:
+			changed[cog_setting] = _decode_section(cog_setting, template[cog_setting])
+			print(
+				"WARNING: The settings file for {} was missing the {} cog. This has been fixed with the template version. It is disabled by default.".format(
+					name.upper(), cog_setting.upper()))
+			continue
+		for setting in template[cog_setting]:
+			if setting not in settings[cog_setting]:
+				if cog_setting not in changed:
+					changed[cog_setting] = _decode_section(cog_setting, settings[cog_setting])
+				changed[cog_setting][setting] = copy.deepcopy(template[cog_setting][setting])
+				print(
+					"WARNING: The settings file for {} was missing the {} setting in the {} cog. This has been fixed with the template version. It is disabled by default.".format(
+						name.upper(), setting.upper(), cog_setting.upper()))
+	return changed
 
 
 def error_check(servers):
-	settings = _open_config()
-	for server in servers:
+	"""
+	Makes sure every guild has settings that match guild_template.
+	Guilds without settings get the template. If the template has changed since the last boot, every saved guild is checked
+	for missing cogs and settings in memory. All fixes are saved in one write along with the new schema version, so boots
+	after that only have to look for new guilds.
+	:param servers: All guilds the bot can see.
+	"""
+	names = {str(server.id): server.name for server in servers}
+	version = schema_version()
+
+	if _store.get_meta("schema_version") != version:
+		for server_id in _store:
+			changed = _migrate_guild(_store.get(server_id), names.get(server_id, server_id))
+			for section, value in changed.items():
+				_store.set_section(server_id, section, value)
+		_store.set_meta("schema_version", version)
+
+	for server_id, name in names.items():
 		# Server ID needs to be made a string for this statement because keys have to be strings in JSON. Which is annoying now we use int for ids.
-		server_id = str(server.id)
-		if str(server_id) not in settings:
-			settings[server_id] = guild_template["example"]
-			_write_changes(settings)
+		if server_id not in _store:
+			_store.set_guild(server_id, guild_template["example"])
 			print(
 				"WARNING: The settings file for {} was not found. A template has been loaded and saved. All cogs are turned off by default.".format(
-					server.name.upper()))
-		else:
-			for cog_setting in guild_template["example"]:
-				if cog_setting not in settings[server_id]:
-					settings[server_id][cog_setting] = guild_template["example"][
-						cog_setting]
-					_write_changes(settings)
-					print(
-						"WARNING: The settings file for {} was missing the {} cog. This has been fixed with the template version. It is disabled by default.".format(
-							server.name.upper(), cog_setting.upper()))
-				for setting in guild_template["example"][cog_setting]:
-					if setting not in settings[server_id][cog_setting]:
-						settings[server_id][cog_setting][setting] = guild_template["example"][
-							cog_setting][setting]
-						_write_changes(settings)
-						print(
-							"WARNING: The settings file for {} was missing the {} setting in the {} cog. This has been fixed with the template version. It is disabled by default.".format(
-								server.name.upper(), setting.upper(), cog_setting.upper()))
+					name.upper()))
+	_store.flush()
 
 
 def get_all(guilds):
@@ -167,75 +596,111 @@ class GuildSettings(object):
 	"""
 	An Object to store all settings for one guild.
 	The goal is to make editing settings a lot easier and make it so you don't have to handle things like ID's which caused a lot of issues when moving over to discord.py 1.0
+
+	Settings are served from the SettingsStore. Each section (self.logging, self.nsfw, etc.) is copied out of the store the first time it is used,
+	so changes made to it are only saved when update() is called.
 	"""
-	__slots__ = ["settings", "id", "name", "logging", "nsfw", "self_assign", "greets", "goodbyes", "twitch", "perm_roles", "custom_commands", "warnings", "is_anal", "voice", "gss"]
+	__slots__ = ["_sections", "id", "name"]
 
 	def __init__(self, guild):
 		self.id = guild.id
 		self.name = str(guild)
-		self.settings = self.refresh()
-
-		self.get_settings()
+		self._sections = {}
+		_store.get(self.id)  # Raise KeyError early for guilds without settings, like before.
 
 	def __str__(self):
 		return self.name
 
 	def __iter__(self):
-		list_settings = list(self.settings)
+		list_settings = list(_store.get(self.id))
 		list_settings.sort()
 		for setting in list_settings:
 			yield setting
 
-	@staticmethod
-	def _convert(settings, option="int"):
-		for key, setting in settings.items():
-			if setting.get("convert"):
-				for x in setting["convert"].keys():
-					if setting["convert"][x] != "bool":
-						if isinstance(setting[x], list):
-							for y, value in enumerate(setting[x]):
-								if option == "str":
-									setting[x][y] = str(value)
-								else:
-									setting[x][y] = int(value)
-						else:
-							if option == "str":
-								setting[x] = str(setting[x])
-							else:
-								setting[x] = int(setting[x])
-			settings[key] = setting
-		return settings
+	def __getattr__(self, item):
+		# Only called for names that aren't slots, which are the settings sections.
+		try:
+			return self._sections[item]
+		except KeyError:
+			pass
+		try:
+			section = _decode_section(item, _store.get(self.id)[item])
+		except KeyError:
+			raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, item))
+		self._sections[item] = section
+		return section
+
+	@property
+	def settings(self):
+		return {section: getattr(self, section) for section in _store.get(self.id)}
 
 	def refresh(self):
-		settings = _open_config()[str(self.id)]
-		self._convert(settings)
-		return settings
-
-	def get_settings(self):
-		self.logging = self.settings["logging"]
-		self.nsfw = self.settings["nsfw"]
-		self.self_assign = self.settings["self_assign"]
-		self.greets = self.settings["greets"]
-		self.goodbyes = self.settings["goodbyes"]
-		self.twitch = self.settings["twitch"]
-		self.perm_roles = self.settings["perm_roles"]
-		self.custom_commands = self.settings["custom_commands"]
-		self.warnings = self.settings["warnings"]
-		self.is_anal = self.settings["is_anal"]
-		self.voice = self.settings["voice"]
-		# Add custom cog settings loading here
-		self.gss = self.settings["gss"]
-
-	def update(self, changed_dict, setting = None):
-		self.settings = self.refresh()
-		self.get_settings()
+		"""Drops this object's copies of the settings so the next access gets the latest version from the store."""
+		self._sections = {}
+
+	def update(self, changed_dict, setting=None):
 		if setting is not None:
-			self.settings[setting] = changed_dict
+			_store.set_section(self.id, setting, changed_dict)
+			self._sections[setting] = changed_dict
 		else:
-			self.settings = changed_dict
-		settings = self.settings.copy()
-		self._convert(settings, "str")
-		json = _open_config()
-		json[str(self.id)] = settings
-		_write_changes(json)
-		self.get_settings()
+			_store.set_guild(self.id, changed_dict)
+			self.refresh()
+
+	def transaction(self):
+		"""
+		Returns a Transaction for this guild, to be used with async with. See Transaction.
+		:return: :type Transaction:
+		"""
+		return Transaction(self)
+
+
+class Transaction(GuildSettings):
+	"""
+	Batches changes to several sections of one guild into a single save. Made with GuildSettings.transaction():
+
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			settings.greets["enabled"] = 1
+			settings.goodbyes["enabled"] = 1
+
+	Entering waits for the guild's lock, so only one transaction per guild runs at a time and each one starts from the latest settings.
+	This stops two commands that await in the middle of editing from losing each other's changes.
+	Other transactions on the guild wait while a block runs, so do anything that waits on Discord (replies, fetching bans) outside it.
+	Changes made without a transaction, like GuildSettings.update() or restore(), don't take the lock.
+	Every section used in the block that was changed is applied to the store in one go when the block exits. Nothing is applied if it raises.
+	"""
+	__slots__ = ["_parent", "_lock"]
+
+	def __init__(self, parent):
+		self.id = parent.id
+		self.name = parent.name
+		self._sections = {}
+		self._parent = parent
+		if parent.id not in _locks:
+			_locks[parent.id] = asyncio.Lock()
+		self._lock = _locks[parent.id]
+
+	async def __aenter__(self):
+		await self._lock.acquire()
+		self.refresh()
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		try:
+			if exc_type is None:
+				self.commit()
+		finally:
+			self._lock.release()
+
+	def update(self, changed_dict, setting=None):
+		"""Inside a transaction update() only stages the change. It is saved with everything else when the block exits."""
+		if setting is not None:
+			self._sections[setting] = changed_dict
+		else:
+			self._sections.update(changed_dict)
+
+	def commit(self):
+		stored = _store.get(self.id)
+		changed = {section: value for section, value in self._sections.items() if stored.get(section) != value}
+		if changed:
+			_store.set_sections(self.id, changed)
+			self._parent._sections.update(changed)
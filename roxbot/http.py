@@ -1,41 +1,635 @@
+import io
+import os
+import re
 import json
+import time
+import random
+import tempfile
+import asyncio
 import aiohttp
+import traceback
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+from roxbot.load_config import http_timeout
+
+HEADERS = {'User-agent': 'RoxBot Discord Bot'}
+CONNECTION_LIMIT = 100  # Open connections across every host.
+CONNECTION_LIMIT_PER_HOST = 10
+DNS_CACHE_TTL = 300  # Seconds to remember a host's address for.
+TIMEOUT = aiohttp.ClientTimeout(total=http_timeout, connect=10)
+
+# How long api_request responses are cached for, by URL. The first pattern that matches is used and URLs that don't match aren't cached.
+# Each is (pattern, seconds the response is fresh for, seconds after that it can still be used while it is fetched again in the background).
+CACHE_TTLS = [
+	(re.compile(r"^https?://(www\.)?reddit\.com/r/"), 5 * 60, 30 * 60),
+	(re.compile(r"^https?://xkcd\.com/+\d+/info\.0\.json"), 7 * 24 * 60 * 60, 7 * 24 * 60 * 60),
+	(re.compile(r"^https?://xkcd\.com/+info\.0\.json"), 10 * 60, 60 * 60),
+	(re.compile(r"^https?://www\.explainxkcd\.com/wiki/api\.php"), 24 * 60 * 60, 24 * 60 * 60),
+	(re.compile(r"^https?://numbersapi\.com/+(?!/*random)"), 24 * 60 * 60, 24 * 60 * 60),
+	(re.compile(r"^https?://frog\.tips/api/"), 10 * 60, 0),
+]
+NEGATIVE_TTL = 60  # Seconds errors and responses that aren't JSON are cached for, so a bad URL isn't asked for again straight away.
+CACHE_MAX_BYTES = 16 * 1024 * 1024  # Total size of the response bodies kept.
+MAX_DOWNLOAD_SIZE = 8 * 1024 * 1024  # Default biggest file download_file will fetch. The same as Discord's upload limit.
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_DIR = os.path.join(tempfile.gettempdir(), "roxbot")
+
+# Requests per second and burst size for each host, so a busy command can't get roxbot rate limited or banned by an API.
+RATE_LIMITS = {
+	"reddit.com": (1, 10),
+	"opentdb.com": (0.5, 2),
+	"e621.net": (2, 2),
+	"api.tatsumaki.xyz": (1, 5),
+}
+DEFAULT_RATE_LIMIT = (5, 10)
+MAX_RETRIES = 3  # Retries for GET requests that fail to connect or get a 429 or 5xx. Timeouts aren't retried.
+BACKOFF_BASE = 0.5  # Seconds before the first retry, doubled for each one after.
+BACKOFF_MAX = 30  # Longest a retry will wait, even if Retry-After asks for longer.
+BREAKER_THRESHOLD = 5  # Failed attempts in a row, retries included, before a host is treated as down.
+BREAKER_COOLDOWN = 60  # Seconds a down host is left alone before one request is let through to test it.
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Upper bounds in seconds. Anything slower goes in one last bucket.
+MAX_ENDPOINTS = 50  # Endpoints tracked per host. Any more are counted together as "other".
+
+_session = None
+
+
+def get_session():
+	"""
+	Returns the session shared by all of roxbot. Connections to a host are kept open and reused between requests, so most requests
+	skip DNS lookups and TCP and TLS handshakes. It is made the first time it is needed so it belongs to the running event loop.
+	:return: :type aiohttp.ClientSession:
+	"""
+	global _session
+	if _session is None or _session.closed:
+		connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT, limit_per_host=CONNECTION_LIMIT_PER_HOST, ttl_dns_cache=DNS_CACHE_TTL)
+		_session = aiohttp.ClientSession(connector=connector, timeout=TIMEOUT, headers=HEADERS)
+	return _session
+
+
+class Histogram:
+	"""Counts of how long requests to the host took, in LATENCY_BUCKETS. Each attempt is counted, not counting time spent waiting to send it."""
+	__slots__ = ["counts", "total", "count"]
+
+	def __init__(self):
+		self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+		self.total = 0.0
+		self.count = 0
+
+	def observe(self, seconds):
+		for x, bound in enumerate(LATENCY_BUCKETS):
+			if seconds <= bound:
+				break
+		else:
+			x = len(LATENCY_BUCKETS)
+		self.counts[x] += 1
+		self.total += seconds
+		self.count += 1
+
+	def percentile(self, percent):
+		"""
+		:return The upper bound of the bucket the percentile falls in, in seconds, or None if nothing has been observed. inf if it is past the last one.:
+		"""
+		if not self.count:
+			return None
+		wanted = self.count * percent / 100
+		seen = 0
+		for x, count in enumerate(self.counts):
+			seen += count
+			if seen >= wanted:
+				return LATENCY_BUCKETS[x] if x < len(LATENCY_BUCKETS) else float("inf")
+
+	def to_dict(self):
+		buckets = {"<={}s".format(bound): count for bound, count in zip(LATENCY_BUCKETS, self.counts)}
+		buckets[">{}s".format(LATENCY_BUCKETS[-1])] = self.counts[-1]
+		return {
+			"count": self.count,
+			"average": self.total / self.count if self.count else None,
+			"p50": self.percentile(50),
+			"p95": self.percentile(95),
+			"buckets": buckets
+		}
+
+
+class RequestStats:
+	"""Stats for a host or one of its endpoints."""
+	__slots__ = ["latency", "waiting", "requests", "in_flight", "bytes", "statuses", "cache"]
+
+	def __init__(self):
+		self.latency = Histogram()
+		self.waiting = 0.0  # Seconds spent waiting on our own rate limit and retry backoff, kept out of latency.
+		self.requests = 0
+		self.in_flight = 0
+		self.bytes = 0
+		self.statuses = {}  # Status code, or the exception name if there wasn't a response, to count.
+		self.cache = {}  # "hit", "stale", "miss", "fallback" or "coalesced" to count.
+
+	def to_dict(self):
+		return {
+			"requests": self.requests,
+			"in_flight": self.in_flight,
+			"bytes": self.bytes,
+			"statuses": {str(status): count for status, count in self.statuses.items()},
+			"cache": dict(self.cache),
+			"latency": self.latency.to_dict(),
+			"waiting": self.waiting
+		}
+
+
+_stats = {}  # Host to (host stats, {endpoint: stats})
+
+
+def _endpoint(url):
+	"""The path of the url with numbers taken out, so every xkcd comic is counted as one endpoint."""
+	parts = urlsplit(url)
+	return re.sub(r"\d+", "#", parts.path or "/")
+
+
+def _stats_for(url):
+	"""
+	:return Stats for the url's host and for its endpoint: :type tuple(RequestStats, RequestStats):
+	"""
+	name = _host_name(url)
+	if name not in _stats:
+		_stats[name] = (RequestStats(), {})
+	host, endpoints = _stats[name]
+	endpoint = _endpoint(url)
+	if endpoint not in endpoints:
+		if len(endpoints) >= MAX_ENDPOINTS:
+			endpoint = "other"
+		endpoints.setdefault(endpoint, RequestStats())
+	return host, endpoints[endpoint]
+
+
+def _count_cache(url, result):
+	for stats in _stats_for(url):
+		stats.cache[result] = stats.cache.get(result, 0) + 1
+
+
+def stats(host=None):
+	"""
+	Everything recorded about requests made through roxbot.http since the bot started.
+	:param host: Only give this host's stats.
+	:return {host: {...stats, "endpoints": {endpoint: stats}}}: :type dict:
+	"""
+	output = {}
+	for name, (host_stats, endpoints) in _stats.items():
+		if host is None or name == host:
+			output[name] = dict(host_stats.to_dict(), endpoints={endpoint: x.to_dict() for endpoint, x in endpoints.items()})
+	return output
+
+
+def dump_stats(filename="httpstats.json"):
+	"""
+	Writes stats() to a JSON file.
+	:return filename:
+	"""
+	with open(filename, "w") as fp:
+		json.dump(stats(), fp, indent=4)
+	return filename
+
+
+class HostUnavailable(Exception):
+	"""Raised instead of making a request to a host that keeps failing."""
+	def __init__(self, host):
+		self.host = host
+		super().__init__("{} isn't responding right now. Try again in a minute.".format(host))
+
+
+class TokenBucket:
+	__slots__ = ["rate", "capacity", "tokens", "updated"]
+
+	def __init__(self, rate, capacity):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	async def acquire(self):
+		"""Waits until a request can be made. Tokens can go negative, which queues callers up in the order they asked."""
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		self.tokens -= 1
+		if self.tokens < 0:
+			await asyncio.sleep(-self.tokens / self.rate)
+
+
+class CircuitBreaker:
+	"""Stops requests to a host after BREAKER_THRESHOLD failures in a row, then lets one through every BREAKER_COOLDOWN to see if it is back."""
+	__slots__ = ["failures", "retry_at"]
+
+	def __init__(self):
+		self.failures = 0
+		self.retry_at = 0
+
+	def allow(self):
+		if self.failures < BREAKER_THRESHOLD:
+			return True
+		now = time.monotonic()
+		if now >= self.retry_at:
+			self.retry_at = now + BREAKER_COOLDOWN
+			return True
+		return False
+
+	@property
+	def tripped(self):
+		return self.failures >= BREAKER_THRESHOLD
+
+	def success(self):
+		self.failures = 0
+
+	def failure(self):
+		self.failures += 1
+		if self.failures == BREAKER_THRESHOLD:
+			self.retry_at = time.monotonic() + BREAKER_COOLDOWN
+
+
+class Host:
+	__slots__ = ["bucket", "breaker"]
+
+	def __init__(self, name):
+		self.bucket = TokenBucket(*RATE_LIMITS.get(name, DEFAULT_RATE_LIMIT))
+		self.breaker = CircuitBreaker()
+
+
+_hosts = {}
+
+
+def _host_name(url):
+	name = urlsplit(url).hostname or ""
+	if name.startswith("www."):
+		name = name[4:]
+	return name
+
+
+def _get_host(url):
+	name = _host_name(url)
+	if name not in _hosts:
+		_hosts[name] = Host(name)
+	return name, _hosts[name]
+
+
+def _retry_delay(resp, attempt):
+	"""Seconds to wait before retrying. Uses Retry-After if the server sent it, otherwise exponential backoff with jitter."""
+	retry_after = resp.headers.get("Retry-After") if resp is not None else None
+	if retry_after:
+		try:
+			return max(0.0, float(retry_after))
+		except ValueError:
+			try:
+				return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+			except (TypeError, ValueError):
+				pass
+	return BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1)
+
+
+class _Request:
+	def __init__(self, method, url, **kwargs):
+		self.method = method
+		self.url = url
+		self.kwargs = kwargs
+		self.resp = None
+		self.stats = _stats_for(url)
+
+	def _record(self, status):
+		for stats in self.stats:
+			stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+	async def _wait(self, waiting):
+		"""Awaits the rate limiter or a backoff sleep, counting the time as waiting."""
+		start = time.monotonic()
+		await waiting
+		for stats in self.stats:
+			stats.waiting += time.monotonic() - start
+
+	def _observe(self, start):
+		taken = time.monotonic() - start
+		for stats in self.stats:
+			stats.latency.observe(taken)
+
+	def _finish(self):
+		received = 0
+		if self.resp is not None:
+			# total_bytes is what was actually read, which can be less than Content-Length if a download was cut short.
+			received = getattr(self.resp.content, "total_bytes", None) or self.resp.content_length or 0
+		for stats in self.stats:
+			stats.in_flight -= 1
+			stats.bytes += received
+
+	async def __aenter__(self):
+		for stats in self.stats:
+			stats.requests += 1
+			stats.in_flight += 1
+		try:
+			return await self._send()
+		except BaseException as e:
+			self._record(type(e).__name__)
+			self._finish()
+			raise
+
+	async def _send(self):
+		name, host = _get_host(self.url)
+		if not host.breaker.allow():
+			raise HostUnavailable(name)
+		retries = MAX_RETRIES if self.method == "GET" else 0
+
+		for attempt in range(retries + 1):
+			await self._wait(host.bucket.acquire())
+			start = time.monotonic()
+			try:
+				resp = await get_session().request(self.method, self.url, **self.kwargs)
+			except asyncio.TimeoutError:
+				# A host that hung once will likely hang again, and every retry would hold the command up for another whole timeout.
+				self._observe(start)
+				host.breaker.failure()
+				raise
+			except aiohttp.ClientError:
+				self._observe(start)
+				host.breaker.failure()
+				if attempt == retries or host.breaker.tripped:
+					raise
+				await self._wait(asyncio.sleep(_retry_delay(None, attempt)))
+				continue
+
+			self._observe(start)
+			self._record(resp.status)
+			if resp.status != 429 and resp.status < 500:
+				host.breaker.success()
+				self.resp = resp
+				return resp
+			host.breaker.failure()
+			delay = _retry_delay(resp, attempt)
+			if attempt == retries or delay > BACKOFF_MAX or host.breaker.tripped:
+				self.resp = resp
+				return resp
+			resp.release()
+			await self._wait(asyncio.sleep(delay))
+
+	async def __aexit__(self, exc_type, exc, tb):
+		if self.resp is not None:
+			self.resp.release()
+		self._finish()
+
+
+def request(method, url, **kwargs):
+	"""
+	Makes a request with the shared session, used as `async with roxbot.http.request("GET", url) as resp:`.
+	Requests are rate limited per host. GET requests are retried with backoff when they fail to connect or get a 429 or 5xx, but not
+	when they time out. Every failed attempt counts towards the host's circuit breaker, and hosts that keep failing raise HostUnavailable
+	straight away instead of tying up a command until it times out.
+	If the retries run out on a 429 or 5xx, the last response is returned like it would have been without retrying.
+	:param method: HTTP method
+	:param url:
+	:param kwargs: Passed on to aiohttp.ClientSession.request
+	"""
+	return _Request(method, url, **kwargs)
+
+
+async def close():
+	"""Closes the shared session and its connections. Done by the bot's close(), so it happens however the bot is stopped."""
+	global _session
+	if _session is not None and not _session.closed:
+		await _session.close()
+	_session = None
+
+
+class CacheEntry:
+	__slots__ = ["body", "etag", "last_modified", "expires", "stale_until", "refreshing"]
+
+	def __init__(self, body, etag, last_modified, expires, stale_until):
+		self.body = body
+		self.etag = etag
+		self.last_modified = last_modified
+		self.expires = expires
+		self.stale_until = stale_until
+		self.refreshing = False
+
+
+class ResponseCache:
+	"""
+	Least recently used cache of raw response bodies, limited by the total size of the bodies rather than how many there are.
+	Bodies are kept as bytes and decoded for each caller, so callers that change what they get back can't change the cache.
+	"""
+	def __init__(self, max_bytes=CACHE_MAX_BYTES):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.entries = OrderedDict()
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is not None:
+			self.entries.move_to_end(key)
+		return entry
+
+	def put(self, key, entry):
+		self.remove(key)
+		if len(entry.body) > self.max_bytes // 4:
+			return  # One huge response would push everything else out.
+		self.entries[key] = entry
+		self.size += len(entry.body)
+		while self.size > self.max_bytes:
+			_, oldest = self.entries.popitem(last=False)
+			self.size -= len(oldest.body)
+
+	def remove(self, key):
+		entry = self.entries.pop(key, None)
+		if entry is not None:
+			self.size -= len(entry.body)
+
+	def clear(self):
+		self.entries.clear()
+		self.size = 0
+
+
+_cache = ResponseCache()
+_background = set()  # Refreshes running in the background, kept so they aren't garbage collected before they finish.
+_inflight = {}  # Request key to the task fetching it, so identical requests made at the same time share one fetch.
+
+
+def _cache_policy(url):
+	for pattern, ttl, stale in CACHE_TTLS:
+		if pattern.match(url):
+			return ttl, stale
+	return None
+
+
+def _request_key(method, url, headers=None):
+	return method, url, tuple(sorted((headers or {}).items()))
+
+
+async def _coalesce(key, fetch):
+	"""
+	Runs fetch() once for everyone asking for the same key at the same time. Anyone who asks while it is running waits for the same result.
+	:param key: From _request_key().
+	:param fetch: Function returning the coroutine to run. Its result is shared, so it should be something callers can't change, like bytes.
+	"""
+	task = _inflight.get(key)
+	if task is not None:
+		_count_cache(key[1], "coalesced")
+	else:
+		task = asyncio.ensure_future(fetch())
+		_inflight[key] = task
+		task.add_done_callback(lambda _: _inflight.pop(key, None))
+	# Shielded so one caller giving up, like a command being cancelled, doesn't cancel it for everyone else.
+	return await asyncio.shield(task)
+
+
+async def _read(url, headers=None):
+	async with request("GET", url, headers=headers) as resp:
+		return await resp.read()
+
+
+def _decode(body):
+	try:
+		return json.loads(body)
+	except (json.JSONDecodeError, UnicodeDecodeError):
+		return None
+
+
+async def _fetch(key, url, headers, policy, entry):
+	"""
+	Gets the url, or checks the cached copy is still current if there is one, and caches the result.
+	Errors are only cached when there is no good copy to keep using.
+	"""
+	request_headers = dict(headers or {})
+	if entry is not None and entry.etag:
+		request_headers["If-None-Match"] = entry.etag
+	if entry is not None and entry.last_modified:
+		request_headers["If-Modified-Since"] = entry.last_modified
+
+	async with request("GET", url, headers=request_headers) as resp:
+		etag = resp.headers.get("ETag")
+		last_modified = resp.headers.get("Last-Modified")
+		if resp.status == 304 and entry is not None:
+			# Unchanged, so keep the body and validators from before unless the server sent new ones.
+			body = entry.body
+			etag = etag or entry.etag
+			last_modified = last_modified or entry.last_modified
+		else:
+			body = await resp.read()
+		ok = resp.status in (200, 304) and _decode(body) is not None
+
+	now = time.monotonic()
+	if not ok and entry is not None and _decode(entry.body) is not None:
+		# Keep the good copy rather than replacing it with the error, and leave the host alone as long as a negative result would.
+		entry.expires = now + NEGATIVE_TTL
+		entry.stale_until = max(entry.stale_until, entry.expires)
+		_cache.put(key, entry)
+		_count_cache(url, "fallback")
+		return entry
+	ttl, stale = policy if ok else (NEGATIVE_TTL, 0)
+	new_entry = CacheEntry(body, etag if ok else None, last_modified if ok else None, now + ttl, now + ttl + stale)
+	_cache.put(key, new_entry)
+	return new_entry
+
+
+async def _refresh(key, url, headers, policy, entry):
+	try:
+		await _coalesce(key, lambda: _fetch(key, url, headers, policy, entry))
+	except Exception:
+		# The stale copy is still there to use, so just try again next time it's asked for.
+		traceback.print_exc()
+	finally:
+		entry.refreshing = False
 
 
 async def api_request(url, *, headers=None):
 	"""
 	Returns a JSON dict object for most api calls in RoxBot.
+	URLs matching CACHE_TTLS are answered from the cache while they are fresh. Once they aren't, the stale copy is returned and
+	fetched again in the background, using the ETag or Last-Modified the server gave so unchanged responses aren't downloaded again.
+	If the host is down, whatever was last cached for the url is returned no matter how old it is.
 	:param url: URL Should be a api endpoint that will return
 	:param headers: There is no need to pass the user agent, this is done for you.
 	:return: dict of JSON or None if a JSON was not returned from the call.
 	"""
-	if headers is None:
-		headers = {'User-agent': 'RoxBot Discord Bot'}
+	key = _request_key("GET", url, headers)
+	policy = _cache_policy(url)
+	if policy is None:
+		return _decode(await _coalesce(key, lambda: _read(url, headers)))
+
+	entry = _cache.get(key)
+	now = time.monotonic()
+	if entry is not None and now < entry.expires:
+		_count_cache(url, "hit")
+	elif entry is not None and now < entry.stale_until:
+		_count_cache(url, "stale")
+		if not entry.refreshing:
+			entry.refreshing = True
+			task = asyncio.ensure_future(_refresh(key, url, headers, policy, entry))
+			_background.add(task)
+			task.add_done_callback(_background.discard)
 	else:
-		headers = {'User-agent': 'RoxBot Discord Bot', **headers}
-	async with aiohttp.ClientSession() as session:
-		async with session.get(url, headers=headers) as resp:
-			try:
-				return json.loads(await resp.read())
-			except json.JSONDecodeError:
-				return None
+		_count_cache(url, "miss")
+		try:
+			entry = await _coalesce(key, lambda: _fetch(key, url, headers, policy, entry))
+		except (HostUnavailable, aiohttp.ClientError, asyncio.TimeoutError):
+			if entry is None:
+				raise
+			_count_cache(url, "fallback")  # An old answer is better than none while the host is down.
+	# Decoded separately for every caller, even ones that shared a fetch, so they each get their own copy to change.
+	return _decode(entry.body)
+
+
+class DownloadTooLarge(Exception):
+	"""Raised when a download is bigger than the max_size it was allowed."""
+	def __init__(self, url, max_size):
+		self.url = url
+		self.max_size = max_size
+		super().__init__("The file is bigger than the {:.1f}MB limit.".format(max_size / 1024 / 1024))
 
 
-async def download_file(url, filename=None):
+async def _stream(url, fp, max_size):
+	"""Writes the body of the url to fp a chunk at a time. Stops as soon as it is known to be bigger than max_size."""
+	async with request("GET", url) as resp:
+		if resp.content_length is not None and resp.content_length > max_size:
+			raise DownloadTooLarge(url, max_size)
+		size = 0
+		async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+			size += len(chunk)
+			# Content-Length can be missing or wrong, so the size is checked as it arrives too.
+			if size > max_size:
+				raise DownloadTooLarge(url, max_size)
+			fp.write(chunk)
+
+
+async def download_file(url, filename=None, *, max_size=MAX_DOWNLOAD_SIZE):
 	"""
 	Downloads the file at the given url and then saves it under the filename given to disk.
-	:param filename:
+	The file is streamed to disk rather than read into memory and nothing is left behind if it fails or goes over max_size.
+	:param filename: If not given, the file is saved in a temp directory under the name from the url. Remove it when done.
 	:param url:
+	:param max_size: Biggest size in bytes the file can be. DownloadTooLarge is raised if it is bigger.
+	:return: filename the file was saved as.
 	"""
 	if filename is None:
-		filename = url.split("/")[-1].split("?")[0]
-	async with aiohttp.ClientSession() as session:
-		async with session.get(url, headers={'User-agent': 'RoxBot Discord Bot'}) as data:
-			with open(filename, 'wb') as f:
-				f.write(await data.read())
+		os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+		fd, filename = tempfile.mkstemp(suffix="_" + url.split("/")[-1].split("?")[0], dir=DOWNLOAD_DIR)
+		os.close(fd)
+	try:
+		with open(filename, 'wb') as f:
+			await _stream(url, f, max_size)
+	except BaseException:
+		os.remove(filename)
+		raise
 	return filename
 
 
+async def download_bytes(url, *, max_size=MAX_DOWNLOAD_SIZE):
+	"""
+	Downloads the file at the given url into memory, for things that don't need it on disk like images being sent straight back.
+	:param url:
+	:param max_size: Biggest size in bytes the file can be. DownloadTooLarge is raised if it is bigger.
+	:return: :type io.BytesIO: seeked back to the start.
+	"""
+	buffer = io.BytesIO()
+	await _stream(url, buffer, max_size)
+	buffer.seek(0)
+	return buffer
+
+
 async def upload_file(url, file):
 	"""
 
@@ -43,9 +637,9 @@ async def upload_file(url, file):
 	:param file: Byes-like object to upload.
 	:return:
 	"""
-	async with aiohttp.ClientSession() as session:
-			payload = {"files": open(file, "rb")}
-			resp = await session.post(url, headers={'User-agent': 'RoxBot Discord Bot', "content_type": "multipart/form-data"}, data=payload)
+	with open(file, "rb") as fp:
+		payload = {"files": fp}
+		async with request("POST", url, headers={"content_type": "multipart/form-data"}, data=payload) as resp:
 			return await resp.json()
 
 
@@ -55,6 +649,7 @@ async def get_page(url):
 	:param url: the url of the page you want to get
 	:return: the html page
 	"""
-	async with aiohttp.ClientSession() as session:
-		async with session.get(url, headers={'User-agent': 'RoxBot Discord Bot'}) as page:
+	async def fetch():
+		async with request("GET", url) as page:
 			return await page.text()
+	return await _coalesce(_request_key("GET", url) + ("text",), fetch)
@@ -0,0 +1,438 @@
+import io
+import os
+import math
+import time
+import hashlib
+import asyncio
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageEnhance, ImageSequence, GifImagePlugin
+
+WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Leave a core for the bot itself.
+MAX_QUEUE = WORKERS * 4  # Jobs running or waiting before new ones are turned away.
+JOB_TIMEOUT = 20  # Seconds a command will wait for its image.
+SOURCE_PIXEL_BUDGET = 16 * 1024 * 1024  # Pixels of decoded images SourceCache keeps, about sixteen 1024px avatars.
+SOURCE_URL_TTL = 10 * 60  # Seconds a url is trusted to still point to the same image.
+OUTPUT_CACHE_BYTES = 32 * 1024 * 1024  # Filter results kept in memory.
+OUTPUT_CACHE_DISK_BYTES = 256 * 1024 * 1024  # Filter results kept on disk, if they are being kept on disk.
+OUTPUT_CACHE_DIR = "roxbot/cache/images"
+OUTPUT_VERSION = 3  # Change this when a filter's output changes so results saved to disk by the old one aren't used.
+MAX_INPUT_PIXELS = 50 * 1000 * 1000  # Images claiming to be bigger than this aren't opened at all.
+MAX_DIMENSION = 1024  # Images are shrunk to fit in this many pixels each way before any filter runs.
+MAX_ANIMATED_DIMENSION = 512  # Same for animations, which have every frame to filter.
+MAX_FRAMES = 60  # Frames of an animation that are filtered. The rest are cut off.
+DEFAULT_FRAME_DURATION = 100  # Milliseconds, for frames that don't say. Browsers show 0 as this anyway.
+UPLOAD_BUDGET = 8 * 1024 * 1024  # Biggest a result can be in bytes, unless the job is given its own budget. Discord's upload limit.
+PNG_COMPRESS_LEVEL = 3  # Pillow's default of 6 takes about twice as long for files a few percent smaller.
+JPEG_QUALITIES = (90, 80, 70, 60, 50)  # Tried in order until the image fits its budget.
+MAX_PALETTE_COLOURS = 256  # Images without transparency and with this many colours or fewer are saved as paletted PNGs.
+SHRINK_STEP = 0.75  # How much an image is scaled by when no encoding of it fits its budget.
+
+# Pillow warns at its own limit and only refuses twice that, so make it refuse at ours.
+Image.MAX_IMAGE_PIXELS = MAX_INPUT_PIXELS // 2
+
+FLAG_ALPHA = 123 / 255  # How much of the image shows through the flag.
+DEEPFRY_STEPS = (
+	(ImageEnhance.Brightness, 1.25),
+	(ImageEnhance.Contrast, 1.5),
+	(ImageEnhance.Sharpness, 20),
+	(ImageEnhance.Color, 2)
+)
+DEEPFRY_QUALITY = 75  # Pillow's default JPEG quality, which the deepfry has always used.
+DEEPFRY_PASSES = 2  # JPEG passes at the end. Any more barely change the image.
+
+
+class ImageServiceError(Exception):
+	"""Raised when the image service can't take or finish a job. The message is fine to show to users."""
+	pass
+
+
+class ImageService:
+	"""
+	Runs Pillow work in a pool of processes so a big image doesn't freeze the event loop (and with it voice and heartbeats).
+	Jobs are plain functions in this module that take and return bytes, so nothing that is slow to pickle is sent between processes.
+	"""
+	def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE, timeout=JOB_TIMEOUT):
+		self.executor = ProcessPoolExecutor(max_workers=workers)
+		self.max_queue = max_queue
+		self.timeout = timeout
+		self.pending = 0
+
+	async def run(self, job, *args):
+		"""
+		Runs job(*args) in the pool.
+		A job that times out keeps running in its worker until it ends, but it still counts against the queue until then so a pile of
+		them can't build up.
+		:param job: Function from this module.
+		:return: Whatever the job returns.
+		"""
+		if self.pending >= self.max_queue:
+			raise ImageServiceError("I'm working on too many images right now. Try again in a bit.")
+		self.pending += 1
+		future = asyncio.get_event_loop().run_in_executor(self.executor, job, *args)
+		future.add_done_callback(self._done)
+		try:
+			return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+		except asyncio.TimeoutError:
+			raise ImageServiceError("That image took too long to process.")
+
+	def _done(self, future):
+		self.pending -= 1
+		if not future.cancelled():
+			future.exception()  # Marks errors from timed out jobs as seen so asyncio doesn't complain about them.
+
+	def shutdown(self):
+		self.executor.shutdown(wait=False)
+
+
+class Source:
+	"""
+	A decoded image as raw pixels, which is quick to send to a worker and turn back into an image there.
+	Animations also keep their file so the frames can be decoded one at a time as they are filtered.
+	"""
+	__slots__ = ["digest", "mode", "size", "data", "animation"]
+
+	def __init__(self, digest, mode, size, data, animation=None):
+		self.digest = digest  # Hash of the file it was decoded from.
+		self.mode = mode
+		self.size = size  # Size every frame is filtered at.
+		self.data = data  # The first frame.
+		self.animation = animation  # The file if it's animated, otherwise None.
+
+	@property
+	def pixels(self):
+		"""Roughly how much memory it takes up, counting an animation's file as if it were RGBA pixels."""
+		pixels = self.size[0] * self.size[1]
+		if self.animation is not None:
+			pixels += len(self.animation) // 4
+		return pixels
+
+	def open(self):
+		return Image.frombytes(self.mode, self.size, self.data)
+
+
+class SourceCache:
+	"""
+	Decoded images kept by the hash of the file they came from, so running a few filters on the same image only downloads and decodes it once.
+	The least recently used are dropped once the images add up to more than max_pixels.
+	"""
+	def __init__(self, max_pixels=SOURCE_PIXEL_BUDGET, url_ttl=SOURCE_URL_TTL):
+		self.max_pixels = max_pixels
+		self.url_ttl = url_ttl
+		self.pixels = 0
+		self.images = OrderedDict()
+		self.urls = {}  # Url to (digest, time it was downloaded)
+
+	def digest_for(self, url):
+		"""Hash of the file last downloaded from the url, if it was recent enough. The image itself might not be cached any more."""
+		digest, downloaded = self.urls.get(url, (None, 0))
+		if digest is None or time.monotonic() - downloaded > self.url_ttl:
+			return None
+		return digest
+
+	def get_url(self, url):
+		"""Gets the image last downloaded from the url, without downloading it again."""
+		digest = self.digest_for(url)
+		return None if digest is None else self.get(digest)
+
+	def get(self, digest):
+		source = self.images.get(digest)
+		if source is not None:
+			self.images.move_to_end(digest)
+		return source
+
+	def put(self, url, source):
+		now = time.monotonic()
+		self.urls = {url: value for url, value in self.urls.items() if now - value[1] <= self.url_ttl}
+		self.urls[url] = (source.digest, now)
+		if source.digest in self.images:
+			self.images.move_to_end(source.digest)
+			return
+		self.images[source.digest] = source
+		self.pixels += source.pixels
+		while self.pixels > self.max_pixels and len(self.images) > 1:
+			digest, oldest = self.images.popitem(last=False)
+			self.pixels -= oldest.pixels
+
+
+class OutputCache:
+	"""
+	Finished filter results by (source digest, filter, parameters). The same filter on the same image always gives the same result,
+	so a repeat only costs the upload. Kept in memory up to max_bytes, least recently used out first.
+	If a directory is given, results are also saved there so they last through restarts, up to OUTPUT_CACHE_DISK_BYTES.
+	"""
+	def __init__(self, max_bytes=OUTPUT_CACHE_BYTES, directory=None):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.outputs = OrderedDict()
+		self.directory = directory
+		if directory is not None:
+			os.makedirs(directory, exist_ok=True)
+
+	def _path(self, key):
+		return os.path.join(self.directory, hashlib.sha1(repr((OUTPUT_VERSION, key)).encode()).hexdigest())
+
+	def get(self, key):
+		output = self.outputs.get(key)
+		if output is not None:
+			self.outputs.move_to_end(key)
+		elif self.directory is not None:
+			try:
+				with open(self._path(key), "rb") as fp:
+					output = fp.read()
+			except FileNotFoundError:
+				return None
+			os.utime(self._path(key))  # The file's mtime is used to find the least recently used ones.
+			self._remember(key, output)
+		return output
+
+	def put(self, key, output):
+		if key in self.outputs:
+			return
+		self._remember(key, output)
+		if self.directory is not None:
+			path = self._path(key)
+			with open(path + ".tmp", "wb") as fp:
+				fp.write(output)
+			os.replace(path + ".tmp", path)
+			self._prune_disk()
+
+	def _remember(self, key, output):
+		if len(output) > self.max_bytes // 4:
+			return
+		self.outputs[key] = output
+		self.size += len(output)
+		while self.size > self.max_bytes:
+			_, oldest = self.outputs.popitem(last=False)
+			self.size -= len(oldest)
+
+	def _prune_disk(self):
+		files = []
+		for entry in os.scandir(self.directory):
+			if entry.is_file() and not entry.name.endswith(".tmp"):
+				stat = entry.stat()
+				files.append((stat.st_mtime, stat.st_size, entry.path))
+		total = sum(size for _, size, _ in files)
+		for mtime, size, path in sorted(files):
+			if total <= OUTPUT_CACHE_DISK_BYTES:
+				break
+			os.remove(path)
+			total -= size
+
+
+@lru_cache(maxsize=8)
+def flag_overlay(colours, ratio, width, height):
+	"""
+	Makes the stripes of a flag at the size of the image they will go over. Cached because the same avatar sizes come up again and again.
+	Must not be changed as the same image is given to everyone who asks for that flag and size.
+	:return: :type PIL.Image: in RGB
+	"""
+	overlay = Image.new('RGB', (width, height))
+	draw = ImageDraw.Draw(overlay)
+	top = 0
+	for colour, row_ratio in zip(colours, ratio):
+		# we use math.ceil here to avoid rounding errors when converting float to int
+		bottom = top + int(math.ceil(height * row_ratio))
+		draw.rectangle((0, top, width, bottom - 1), fill=colour)
+		top = bottom
+	return overlay
+
+
+def _jpeg_pass(img):
+	"""
+	Encodes the image as a JPEG in memory and opens it again, which is where the artifacts come from.
+	:return (image, buffer with the JPEG in it):
+	"""
+	buffer = io.BytesIO()
+	img.save(buffer, format="JPEG", quality=DEEPFRY_QUALITY)
+	buffer.seek(0)
+	return Image.open(buffer), buffer
+
+
+def _frames(source):
+	"""
+	Decodes an animation a frame at a time so only the frame being filtered is in memory, not the whole animation.
+	:param source: :type Source: that is animated.
+	:return: Generator of (frame in RGBA at source.size, duration in ms), up to MAX_FRAMES of them.
+	"""
+	img = Image.open(io.BytesIO(source.animation))
+	for index, frame in enumerate(ImageSequence.Iterator(img)):
+		if index >= MAX_FRAMES:
+			break
+		duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+		frame = frame.convert("RGBA")
+		if frame.size != source.size:
+			# Several times quicker than LANCZOS, which is most of the cost of a frame, and the difference doesn't show once it moves.
+			frame = frame.resize(source.size, Image.BILINEAR)
+		yield frame, duration
+
+
+def _palette_frame(frame):
+	"""Turns a frame into a 256 colour one for a GIF, with the last colour as transparent where the frame is mostly see through."""
+	if frame.mode != "RGBA":
+		return frame.convert("RGB").quantize(256, method=Image.FASTOCTREE)
+	paletted = frame.convert("RGB").quantize(255, method=Image.FASTOCTREE)
+	paletted.paste(255, mask=frame.getchannel("A").point(lambda a: 255 if a < 128 else 0))
+	paletted.info["transparency"] = 255
+	return paletted
+
+
+def _encode_animation(frames, budget):
+	"""
+	Encodes frames as a looping GIF as they come in. Pillow's save_all keeps every frame until the end to compare them, this keeps one.
+	:param frames: Iterable of (frame, duration in ms), all the same size.
+	:param budget: Biggest the GIF can be in bytes. Frames that would take it over are cut off, though there is always at least one.
+	:return: The GIF :type bytes:
+	"""
+	output = io.BytesIO()
+	for index, (frame, duration) in enumerate(frames):
+		frame = _palette_frame(frame)
+		if index == 0:
+			header, _ = GifImagePlugin.getheader(frame, info={"loop": 0})
+			output.write(b"".join(header))
+		# Every frame covers the whole image, so each one is cleared before the next and has its own colours.
+		params = {"duration": duration, "disposal": 2, "include_color_table": True}
+		if "transparency" in frame.info:
+			params["transparency"] = frame.info["transparency"]
+		data = b"".join(GifImagePlugin.getdata(frame, **params))
+		if index > 0 and output.tell() + len(data) + 1 > budget:
+			break
+		output.write(data)
+	output.write(b";")
+	return output.getvalue()
+
+
+def _save(img, format, **params):
+	output = io.BytesIO()
+	img.save(output, format=format, **params)
+	return output.getvalue()
+
+
+def _encodings(img):
+	"""
+	Generator of ways to encode the image, best first. Each is only made if the one before it was too big.
+	Transparency has to stay PNG. Few colours are a paletted PNG, which is lossless for them and smaller than JPEG. Anything else is a JPEG,
+	which is far smaller than PNG for photos and quicker to make.
+	"""
+	if img.mode == "RGBA" and img.getchannel("A").getextrema()[0] < 255:
+		yield _save(img, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+		return
+	img = img.convert("RGB")
+	colours = img.getcolors(MAX_PALETTE_COLOURS)
+	if colours is not None:
+		yield _save(img.convert("P", palette=Image.ADAPTIVE, colors=len(colours)), "PNG", compress_level=PNG_COMPRESS_LEVEL)
+	for quality in JPEG_QUALITIES:
+		yield _save(img, "JPEG", quality=quality)
+
+
+def encode(img, budget=UPLOAD_BUDGET):
+	"""
+	Encodes a finished image in the format that suits it, shrinking it until it fits in the budget if it has to.
+	:param img: :type PIL.Image:
+	:param budget: Biggest the file can be in bytes.
+	:return: :type bytes:
+	"""
+	while True:
+		for output in _encodings(img):
+			if len(output) <= budget:
+				return output
+		if img.width <= 1 or img.height <= 1:
+			return output
+		img = img.resize((max(1, int(img.width * SHRINK_STEP)), max(1, int(img.height * SHRINK_STEP))), Image.LANCZOS)
+
+
+def extension(data):
+	"""The file extension for an encoded image, worked out from its first few bytes."""
+	if data.startswith(b"GIF8"):
+		return "gif"
+	elif data.startswith(b"\xff\xd8"):
+		return "jpg"
+	elif data[8:12] == b"WEBP":
+		return "webp"
+	return "png"
+
+
+def decode(data):
+	"""
+	Job that decodes an image file into raw pixels, in RGBA if it has any transparency and RGB if it doesn't.
+	Images are shrunk to fit in MAX_DIMENSION so every filter costs about the same however big the upload was.
+	:param data: The image file. :type bytes:
+	:return: (mode, size, pixel data, the file if it's animated) to make a Source with.
+	"""
+	try:
+		img = Image.open(io.BytesIO(data))
+	except Image.DecompressionBombError:
+		raise ImageServiceError("That image is too big.")
+	except OSError:
+		raise ImageServiceError("That isn't an image I can open.")
+	# Only the header has been read at this point, so this is checked before the pixels take up any memory.
+	if img.width * img.height > MAX_INPUT_PIXELS:
+		raise ImageServiceError("That image is too big.")
+	animated = getattr(img, "is_animated", False)
+	limit = MAX_ANIMATED_DIMENSION if animated else MAX_DIMENSION
+	# JPEGs can be decoded at 1/2, 1/4 or 1/8 size for much less work than decoding them in full and shrinking them after.
+	img.draft("RGB", (limit, limit))
+	img.thumbnail((limit, limit), Image.LANCZOS)
+	if img.mode in ('RGBA', 'LA') or 'transparency' in img.info:
+		img = img.convert('RGBA')
+	else:
+		img = img.convert('RGB')
+	return img.mode, img.size, img.tobytes(), data if animated else None
+
+
+def _flag_frame(ava, overlay):
+	alpha = ava.getchannel('A') if ava.mode == 'RGBA' else None
+	ava = ava.convert('RGB')
+
+	# One blend over the whole image instead of a new stripe and mask per row.
+	ava = Image.blend(overlay, ava, FLAG_ALPHA)
+	if alpha is not None:
+		ava.putalpha(alpha)
+	return ava
+
+
+def flag_filter(source, colours, ratio, budget=UPLOAD_BUDGET):
+	"""
+	Job that puts a striped flag over an image. At the moment, can only make horizontal stripe flags.
+	:param source: :type Source:
+	:param colours: RGB tuple for each stripe, top to bottom.
+	:param ratio: How much of the height each stripe takes up.
+	:param budget: Biggest the result can be in bytes.
+	:return: The filtered image, as a GIF if it's animated and from encode() if not :type bytes:
+	"""
+	# Every frame is the same size so they can all share the one overlay.
+	overlay = flag_overlay(colours, ratio, *source.size)
+	if source.animation is not None:
+		return _encode_animation(((_flag_frame(frame, overlay), duration) for frame, duration in _frames(source)), budget)
+	return encode(_flag_frame(source.open(), overlay), budget)
+
+
+def _fry(img):
+	"""
+	:return (deepfried image, buffer with it in as a JPEG):
+	"""
+	img = img.convert("RGB")
+	for enhance, amount in DEEPFRY_STEPS:
+		# Every step works on a JPEG of the last one so the sharpening picks up the artifacts. That's the fried look.
+		img, _ = _jpeg_pass(img)
+		img = enhance(img).enhance(amount)
+	for x in range(DEEPFRY_PASSES):
+		img, buffer = _jpeg_pass(img)
+	return img, buffer
+
+
+def deepfry(source, budget=UPLOAD_BUDGET):
+	"""
+	Job that deepfries an image.
+	:param source: :type Source:
+	:param budget: Biggest the result can be in bytes.
+	:return: The deepfried image as a JPEG, or a GIF if it's animated :type bytes:
+	"""
+	if source.animation is not None:
+		return _encode_animation(((_fry(frame)[0], duration) for frame, duration in _frames(source)), budget)
+	img, buffer = _fry(source.open())
+	# The last pass is already a JPEG, which is the look. Only encode it again if it's too big.
+	if buffer.getbuffer().nbytes <= budget:
+		return buffer.getvalue()
+	return encode(img, budget)
@@ -9,6 +9,10 @@ command_prefix = settings["Roxbot"]["Command_Prefix"]
 token = settings["Roxbot"]["Token"]
 owner = int(settings["Roxbot"]["OwnerID"])
 tat_token = settings["Roxbot"]["Tatsumaki_Token"]
+settings_backend = settings["Roxbot"].get("Settings_Backend", "json")
+http_timeout = float(settings["Roxbot"].get("HTTP_Timeout", 30))
+persist_image_cache = settings["Roxbot"].getboolean("Persist_Image_Cache", False)
+image_upload_budget = int(settings["Roxbot"].get("Image_Upload_Budget", 8 * 1024 * 1024))
 
 
 class EmbedColours(IntEnum):
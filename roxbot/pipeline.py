@@ -0,0 +1,122 @@
+import time
+import traceback
+
+import discord
+
+from roxbot import checks, guild_settings, utils
+from roxbot.load_config import owner, command_prefix
+
+# Permission levels, highest last so they can be compared.
+MEMBER = 0
+MOD = 1
+ADMIN = 2
+OWNER = 3
+
+_stages = []  # (order, name, stage) kept sorted by order.
+_timings = {}  # Stage name to [calls, total seconds, slowest call in seconds].
+
+
+class MessageContext:
+	"""
+	Everything the stages need to know about a message, worked out once no matter how many stages look at it.
+	Settings and the permission level are only worked out the first time a stage asks for them.
+	"""
+	__slots__ = ["bot", "message", "author", "guild", "is_self", "blacklisted", "content", "prefixed", "invoked", "_settings", "_permission"]
+
+	def __init__(self, bot, message):
+		self.bot = bot
+		self.message = message
+		self.author = message.author
+		# Only guild text channels have settings. DMs and group DMs are None.
+		self.guild = message.guild if isinstance(message.channel, discord.TextChannel) else None
+		self.is_self = message.author == bot.user
+		self.blacklisted = message.author.id in utils.blacklist
+		self.content = message.content.lower()
+		self.prefixed = self.content.startswith(command_prefix)
+		# The message without the prefix, or None if there wasn't a prefix.
+		self.invoked = self.content[len(command_prefix):] if self.prefixed else None
+		self._settings = None
+		self._permission = None
+
+	@property
+	def settings(self):
+		"""The guild's settings or None if the message isn't from a guild."""
+		if self._settings is None and self.guild is not None:
+			self._settings = guild_settings.get(self.guild)
+		return self._settings
+
+	@property
+	def permission(self):
+		"""The author's permission level, one of MEMBER, MOD, ADMIN or OWNER."""
+		if self._permission is None:
+			if self.author.id == owner:
+				self._permission = OWNER
+			elif self.guild is None or not isinstance(self.author, discord.Member):
+				self._permission = MEMBER
+			else:
+				admin, staff = checks.perm_roles(self.guild)
+				role_ids = {role.id for role in self.author.roles}
+				if not admin.isdisjoint(role_ids):
+					self._permission = ADMIN
+				elif not staff.isdisjoint(role_ids):
+					self._permission = MOD
+				else:
+					self._permission = MEMBER
+		return self._permission
+
+
+def register(stage, order=50, name=None):
+	"""
+	Adds a stage that every message is passed through. Cogs should use this instead of on_message so the message is only looked at once.
+	:param stage: Coroutine function called as stage(context) with a MessageContext. Return True to stop any later stages from running.
+	:param order: Stages with a lower order run first. Stages with the same order run in the order they were added.
+	:param name: Name for the stage's timings. Defaults to the function's qualified name.
+	:return stage:
+	"""
+	name = name or stage.__qualname__
+	_stages.append((order, name, stage))
+	_stages.sort(key=lambda x: x[0])
+	return stage
+
+
+def unregister(stage):
+	"""Removes a stage given to register(). Should be done when a cog is unloaded."""
+	_stages[:] = [x for x in _stages if x[2] != stage]
+
+
+async def run(bot, message):
+	"""
+	Passes a message through every stage in order until one returns True.
+	:param bot:
+	:param message: :type discord.Message:
+	:return MessageContext:
+	"""
+	context = MessageContext(bot, message)
+	for order, name, stage in list(_stages):
+		start = time.perf_counter()
+		try:
+			stop = await stage(context)
+		except Exception:
+			traceback.print_exc()
+			stop = False
+		taken = time.perf_counter() - start
+		timing = _timings.setdefault(name, [0, 0.0, 0.0])
+		timing[0] += 1
+		timing[1] += taken
+		timing[2] = max(timing[2], taken)
+		if stop:
+			break
+	return context
+
+
+def stats():
+	"""
+	Timings for each stage that has run.
+	:return list of (name, calls, average ms, slowest ms) in the order the stages run: :type list:
+	"""
+	output = []
+	for order, name, stage in _stages:
+		if name in _timings:
+			calls, total, slowest = _timings[name]
+			output.append((name, calls, total / calls * 1000, slowest * 1000))
+	return output
@@ -4,7 +4,7 @@ import datetime
 import discord
 from discord.ext import commands
 
-from roxbot import checks, guild_settings, EmbedColours
+from roxbot import checks, guild_settings, backups, EmbedColours
 
 # TODO: Display the settings your changing in the menu as yu change them.
 
@@ -178,8 +178,14 @@ class Settings:
 	"""
 	def __init__(self, bot_client):
 		self.bot = bot_client
+		self.backups = backups.Backups()
+		self.backups.start()
 		self.bg_task = self.bot.loop.create_task(self.auto_backups())
 
+	def __unload(self):
+		self.bg_task.cancel()
+		self.backups.stop()
+
 	def get_channel(self, ctx, channel):
 		if ctx.message.channel_mentions:
 			return ctx.message.channel_mentions[0]
@@ -188,21 +194,56 @@ class Settings:
 
 	async def auto_backups(self):
 		await self.bot.wait_until_ready()
-		raw_settings = guild_settings._open_config()
+		if not self.backups.last_snapshot:
+			self.backups.snapshot()
 		while not self.bot.is_closed():
-			if raw_settings != guild_settings._open_config():
-				raw_settings = guild_settings._open_config()
-				time = datetime.datetime.now()
-				guild_settings.backup(raw_settings, "{:%Y.%m.%d %H:%M:%S} Auto Backup".format(time))
+			self.backups.tick()
 			await asyncio.sleep(300)
 
+	async def on_guild_role_delete(self, role):
+		"""Takes deleted roles out of the permission roles, which also refreshes the permission checks for that guild."""
+		if role.id not in checks.perm_roles(role.guild)[1]:
+			return
+		async with guild_settings.get(role.guild).transaction() as settings:
+			perm_roles = settings.perm_roles
+			for roles in (perm_roles["admin"], perm_roles["mod"]):
+				while role.id in roles:
+					roles.remove(role.id)
+			settings.update(perm_roles, "perm_roles")
+
 	@commands.command()
 	@commands.is_owner()
 	async def backup(self, ctx):
-		time = datetime.datetime.now()
-		filename = "{:%Y.%m.%d %H:%M:%S} Manual Backup".format(time)
-		guild_settings.backup(guild_settings._open_config(), filename)
-		return await ctx.send("Settings file backed up as '{}.json'".format(filename))
+		"""Takes a full snapshot of the settings now, instead of waiting for the daily one."""
+		filename = self.backups.snapshot()
+		return await ctx.send("Settings backed up as '{}'".format(filename))
+
+	@commands.command()
+	@commands.is_owner()
+	async def restore(self, ctx, *, when=None):
+		"""Restores every guild's settings to how they were at the given time.
+		Usage:
+			;restore YYYY.MM.DD HH:MM:SS
+		Leave the time out to see how far back settings can be restored."""
+		restorable = self.backups.restorable()
+		if restorable is None:
+			return await ctx.send("There are no backups to restore from.")
+		if when is None:
+			oldest = datetime.datetime.fromtimestamp(restorable[0])
+			return await ctx.send("Settings can be restored to any time since {:%Y.%m.%d %H:%M:%S}.".format(oldest))
+		try:
+			when = datetime.datetime.strptime(when, "%Y.%m.%d %H:%M:%S")
+		except ValueError:
+			return await ctx.send("Time should be given as YYYY.MM.DD HH:MM:SS")
+
+		config = self.backups.rebuild(when.timestamp())
+		if config is None:
+			return await ctx.send("There isn't a backup that goes back that far.")
+		guild_settings.restore(config)
+		# Guilds the bot joined after that time are put back to the template instead of being left without settings.
+		guild_settings.error_check(self.bot.guilds)
+		self.backups.snapshot()
+		return await ctx.send("Settings restored to how they were at {:%Y.%m.%d %H:%M:%S}.".format(when))
 
 	def parse_setting(self, ctx, settings_to_copy, raw=False):
 		settingcontent = ""
@@ -292,7 +333,7 @@ class Settings:
 	@commands.group(case_insensitive=True)
 	@checks.is_admin_or_mod()
 	async def settings(self, ctx):
-		self.guild_settings = guild_settings.get(ctx.guild)
+		pass
 
 	@settings.command(aliases=["log"])
 	async def logging(self, ctx, selection=None, *, changes=None):
@@ -302,22 +343,22 @@ class Settings:
 			enable/disable: Enable/disables logging.
 			channel: sets the channel.
 		"""
-		selection = selection.lower()
-		settings = guild_settings.get(ctx.guild)
-
-		if selection == "enable":
-			settings.logging["enabled"] = 1
-			await ctx.send("'logging' was enabled!")
-		elif selection == "disable":
-			settings.logging["enabled"] = 0
-			await ctx.send("'logging' was disabled :cry:")
-		elif selection == "channel":
-			channel = self.get_channel(ctx, changes)
-			settings.logging["channel"] = channel.id
-			await ctx.send("{} has been set as the logging channel!".format(channel.mention))
-		else:
-			return await ctx.send("No valid option given.")
-		return self.guild_settings.update(settings.logging, "logging")
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			selection = selection.lower()
+			if selection == "enable":
+				settings.logging["enabled"] = 1
+				message = "'logging' was enabled!"
+			elif selection == "disable":
+				settings.logging["enabled"] = 0
+				message = "'logging' was disabled :cry:"
+			elif selection == "channel":
+				channel = self.get_channel(ctx, changes)
+				settings.logging["channel"] = channel.id
+				message = "{} has been set as the logging channel!".format(channel.mention)
+			else:
+				message = "No valid option given."
+			settings.update(settings.logging, "logging")
+		return await ctx.send(message)
 
 	@settings.command(aliases=["sa"])
 	async def selfassign(self, ctx, selection=None, *, changes=None):
@@ -327,32 +368,34 @@ class Settings:
 			enable/disable: Enable/disables the cog.
 			addrole/removerole: adds or removes a role that can be self assigned in the server.
 		"""
-
-		selection = selection.lower()
-		role = discord.utils.find(lambda u: u.name == changes, ctx.message.guild.roles)
-
-		self_assign = self.guild_settings.self_assign
-
-		if selection == "enable":
-			self_assign["enabled"] = 1
-			await ctx.send("'self_assign' was enabled!")
-		elif selection == "disable":
-			self_assign["enabled"] = 0
-			await ctx.send("'self_assign' was disabled :cry:")
-		elif selection == "addrole":
-			if role.id in self_assign["roles"]:
-				return await ctx.send("{} is already a self-assignable role.".format(role.name))
-			self_assign["roles"].append(role.id)
-			await ctx.send('Role "{}" added'.format(str(role)))
-		elif selection == "removerole":
-			if role.id in self_assign["roles"]:
-				self_assign["roles"].remove(role.id)
-				await ctx.send('"{}" has been removed from the self-assignable roles.'.format(str(role)))
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			selection = selection.lower()
+			role = discord.utils.find(lambda u: u.name == changes, ctx.message.guild.roles)
+
+			self_assign = settings.self_assign
+
+			if selection == "enable":
+				self_assign["enabled"] = 1
+				message = "'self_assign' was enabled!"
+			elif selection == "disable":
+				self_assign["enabled"] = 0
+				message = "'self_assign' was disabled :cry:"
+			elif selection == "addrole":
+				if role.id in self_assign["roles"]:
+					message = "{} is already a self-assignable role.".format(role.name)
+				else:
+					self_assign["roles"].append(role.id)
+					message = 'Role "{}" added'.format(str(role))
+			elif selection == "removerole":
+				if role.id in self_assign["roles"]:
+					self_assign["roles"].remove(role.id)
+					message = '"{}" has been removed from the self-assignable roles.'.format(str(role))
+				else:
+					message = "That role was not in the list."
 			else:
-				return await ctx.send("That role was not in the list.")
-		else:
-			return await ctx.send("No valid option given.")
-		return self.guild_settings.update(self_assign, "self_assign")
+				message = "No valid option given."
+			settings.update(self_assign, "self_assign")
+		return await ctx.send(message)
 
 	@settings.command(aliases=["jl"])
 	async def joinleave(self, ctx, selection=None, *, changes=None):
@@ -365,48 +408,51 @@ class Settings:
 			greetschannel/goodbyeschannel: Sets the channels for either option. Must be a ID or mention.
 			custommessage: specifies a custom message for the greet messages.
 		"""
+		message = None
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			selection = selection.lower()
+			channel = self.get_channel(ctx, changes)
+			greets = settings.greets
+			goodbyes = settings.goodbyes
+
+			if selection == "greets":
+				if changes == "enable":
+					greets["enabled"] = 1
+					message = "'greets' was enabled!"
+				elif changes == "disable":
+					greets["enabled"] = 0
+					message = "'greets' was disabled :cry:"
+
+			elif selection == "goodbyes":
+				if changes == "enable":
+					goodbyes["enabled"] = 1
+					message = "'goodbyes' was enabled!"
+				elif changes == "disable":
+					goodbyes["enabled"] = 0
+					message = "'goodbyes' was disabled :cry:"
 
-		selection = selection.lower()
-		channel = self.get_channel(ctx, changes)
-		greets = self.guild_settings.greets
-		goodbyes = self.guild_settings.goodbyes
-
-		if selection == "greets":
-			if changes == "enable":
-				greets["enabled"] = 1
-				await ctx.send("'greets' was enabled!")
-			elif changes == "disable":
-				greets["enabled"] = 0
-				await ctx.send("'greets' was disabled :cry:")
-
-		elif selection == "goodbyes":
-			if changes == "enable":
-				goodbyes["enabled"] = 1
-				await ctx.send("'goodbyes' was enabled!")
-			elif changes == "disable":
-				goodbyes["enabled"] = 0
-				await ctx.send("'goodbyes' was disabled :cry:")
-
-		else:
-			if selection == "greetschannel":
-				greets["welcome-channel"] = channel.id
-				changes = "greets"
-				await ctx.send("{} has been set as the welcome channel!".format(channel.mention))
-			elif selection == "goodbyeschannel":
-				goodbyes["goodbye-channel"] = channel.id
-				changes = "goodbyes"
-				await ctx.send("{} has been set as the goodbye channel!".format(channel.mention))
-			elif selection == "custommessage":
-				greets["custom-message"] = changes
-				await ctx.send("Custom message set to '{}'".format(changes))
-				changes = "greets"
 			else:
-				return await ctx.send("No valid option given.")
+				if selection == "greetschannel":
+					greets["welcome-channel"] = channel.id
+					changes = "greets"
+					message = "{} has been set as the welcome channel!".format(channel.mention)
+				elif selection == "goodbyeschannel":
+					goodbyes["goodbye-channel"] = channel.id
+					changes = "goodbyes"
+					message = "{} has been set as the goodbye channel!".format(channel.mention)
+				elif selection == "custommessage":
+					greets["custom-message"] = changes
+					message = "Custom message set to '{}'".format(changes)
+					changes = "greets"
+				else:
+					message = "No valid option given."
 
-		if changes == "greets":
-			return self.guild_settings.update(greets, "greets")
-		elif changes == "goodbyes":
-			return self.guild_settings.update(goodbyes, "goodbyes")
+			if changes == "greets":
+				settings.update(greets, "greets")
+			elif changes == "goodbyes":
+				settings.update(goodbyes, "goodbyes")
+		if message:
+			return await ctx.send(message)
 
 	@settings.command()
 	async def twitch(self, ctx, selection=None, *, changes=None):
@@ -416,25 +462,27 @@ class Settings:
 			enable/disable: Enable/disables the cog.
 			channel: Sets the channel to shill in.
 		"""
-		# TODO: Menu also needs editing since I edited the twitch backend
-		selection = selection.lower()
-		twitch = self.guild_settings.twitch
-
-		if selection == "enable":
-			twitch["enabled"] = 1
-			await ctx.send("'twitch' was enabled!")
-		elif selection == "disable":
-			twitch["enabled"] = 0
-			await ctx.send("'twitch' was disabled :cry:")
-		elif selection == "channel":
-			channel = self.get_channel(ctx, changes)
-			twitch["channel"] = channel.id
-			await ctx.send("{} has been set as the twitch shilling channel!".format(channel.mention))
-		# Is lacking whitelist options. Might be added or might be depreciated.
-		# Turns out this is handled in the cog and I don't think it needs changing but may be confusing.
-		else:
-			return await ctx.send("No valid option given.")
-		return self.guild_settings.update(twitch, "twitch")
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			# TODO: Menu also needs editing since I edited the twitch backend
+			selection = selection.lower()
+			twitch = settings.twitch
+
+			if selection == "enable":
+				twitch["enabled"] = 1
+				message = "'twitch' was enabled!"
+			elif selection == "disable":
+				twitch["enabled"] = 0
+				message = "'twitch' was disabled :cry:"
+			elif selection == "channel":
+				channel = self.get_channel(ctx, changes)
+				twitch["channel"] = channel.id
+				message = "{} has been set as the twitch shilling channel!".format(channel.mention)
+			# Is lacking whitelist options. Might be added or might be depreciated.
+			# Turns out this is handled in the cog and I don't think it needs changing but may be confusing.
+			else:
+				message = "No valid option given."
+			settings.update(twitch, "twitch")
+		return await ctx.send(message)
 
 	@settings.command(aliases=["perms"])
 	async def permrole(self, ctx, selection=None, *, changes=None):
@@ -446,60 +494,63 @@ class Settings:
 		Example:
 			;settings permrole addadmin Admin
 		"""
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			selection = selection.lower()
+			role = discord.utils.find(lambda u: u.name == changes, ctx.message.guild.roles)
+			perm_roles = settings.perm_roles
+
+			if selection == "addadmin":
+				if role.id not in perm_roles["admin"]:
+					perm_roles["admin"].append(role.id)
+					message = "'{}' has been added to the Admin role list.".format(role.name)
+				else:
+					message = "'{}' is already in the list.".format(role.name)
+			elif selection == "addmod":
+				if role.id not in perm_roles["mod"]:
+					perm_roles["mod"].append(role.id)
+					message = "'{}' has been added to the Mod role list.".format(role.name)
+				else:
+					message = "'{}' is already in the list.".format(role.name)
+			elif selection == "removeadmin":
+				try:
+					perm_roles["admin"].remove(role.id)
+					message = "'{}' has been removed from the Admin role list.".format(role.name)
+				except ValueError:
+					message = "That role was not in the list."
+			elif selection == "removemod":
+				try:
+					perm_roles["mod"].remove(role.id)
+					message = "'{}' has been removed from the Mod role list.".format(role.name)
+				except ValueError:
+					message = "That role was not in the list."
 
-		selection = selection.lower()
-		role = discord.utils.find(lambda u: u.name == changes, ctx.message.guild.roles)
-		perm_roles = self.guild_settings.perm_roles
-
-		if selection == "addadmin":
-			if role.id not in perm_roles["admin"]:
-				perm_roles["admin"].append(role.id)
-				await ctx.send("'{}' has been added to the Admin role list.".format(role.name))
-			else:
-				return await ctx.send("'{}' is already in the list.".format(role.name))
-		elif selection == "addmod":
-			if role.id not in perm_roles["mod"]:
-				perm_roles["mod"].append(role.id)
-				await ctx.send("'{}' has been added to the Mod role list.".format(role.name))
 			else:
-				return await ctx.send("'{}' is already in the list.".format(role.name))
-		elif selection == "removeadmin":
-			try:
-				perm_roles["admin"].remove(role.id)
-				await ctx.send("'{}' has been removed from the Admin role list.".format(role.name))
-			except ValueError:
-				return await ctx.send("That role was not in the list.")
-		elif selection == "removemod":
-			try:
-				perm_roles["mod"].remove(role.id)
-				await ctx.send("'{}' has been removed from the Mod role list.".format(role.name))
-			except ValueError:
-				return await ctx.send("That role was not in the list.")
-
-		else:
-			return await ctx.send("No valid option given.")
-		return self.guild_settings.update(perm_roles, "perm_roles")
+				message = "No valid option given."
+			settings.update(perm_roles, "perm_roles")
+		return await ctx.send(message)
 
 	@settings.command()
 	async def gss(self, ctx, selection=None, *, changes=None):
 		"""Custom Cog for the GaySoundsShitposts Discord Server."""
-		# TODO: Menu
-		selection = selection.lower()
-		gss = self.guild_settings.gss
-
-		if selection == "loggingchannel":
-			channel = self.get_channel(ctx, changes)
-			gss["log_channel"] = channel.id
-			await ctx.send("Logging Channel set to '{}'".format(channel.name))
-		elif selection == "requireddays":
-			gss["required_days"] = int(changes)
-			await ctx.send("Required days set to '{}'".format(str(changes)))
-		elif selection == "requiredscore":
-			gss["required_score"] = int(changes)
-			await ctx.send("Required score set to '{}'".format(str(changes)))
-		else:
-			return await ctx.send("No valid option given.")
-		return self.guild_settings.update(gss, "gss")
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			# TODO: Menu
+			selection = selection.lower()
+			gss = settings.gss
+
+			if selection == "loggingchannel":
+				channel = self.get_channel(ctx, changes)
+				gss["log_channel"] = channel.id
+				message = "Logging Channel set to '{}'".format(channel.name)
+			elif selection == "requireddays":
+				gss["required_days"] = int(changes)
+				message = "Required days set to '{}'".format(str(changes))
+			elif selection == "requiredscore":
+				gss["required_score"] = int(changes)
+				message = "Required score set to '{}'".format(str(changes))
+			else:
+				message = "No valid option given."
+			settings.update(gss, "gss")
+		return await ctx.send(message)
 
 	@settings.command()
 	async def nsfw(self, ctx, selection=None, *, changes=None):
@@ -513,46 +564,48 @@ class Settings:
 			Example:
 				;settings nsfw addchannel #nsfw_stuff
 		"""
-		menu = Menu.nsfw(ctx.guild)
-		print(menu.content)
-		selection = selection.lower()
-		nsfw = self.guild_settings.nsfw
-
-		if selection == "enable":
-			nsfw["enabled"] = 1
-			await ctx.send("'nsfw' was enabled!")
-		elif selection == "disable":
-			nsfw["enabled"] = 0
-			await ctx.send("'nsfw' was disabled :cry:")
-		elif selection == "addchannel":
-			channel = self.get_channel(ctx, changes)
-			if channel.id not in nsfw["channels"]:
-				nsfw["channels"].append(channel.id)
-				await ctx.send("'{}' has been added to the nsfw channel list.".format(channel.name))
-			else:
-				return await ctx.send("'{}' is already in the list.".format(channel.name))
-		elif selection == "removechannel":
-			channel = self.get_channel(ctx, changes)
-			try:
-				nsfw["channels"].remove(channel.id)
-				await ctx.send("'{}' has been removed from the nsfw channel list.".format(channel.name))
-			except ValueError:
-				return await ctx.send("That role was not in the list.")
-		elif selection == "addbadtag":
-			if changes not in nsfw["blacklist"]:
-				nsfw["blacklist"].append(changes)
-				await ctx.send("'{}' has been added to the blacklisted tag list.".format(changes))
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			menu = Menu.nsfw(ctx.guild)
+			print(menu.content)
+			selection = selection.lower()
+			nsfw = settings.nsfw
+
+			if selection == "enable":
+				nsfw["enabled"] = 1
+				message = "'nsfw' was enabled!"
+			elif selection == "disable":
+				nsfw["enabled"] = 0
+				message = "'nsfw' was disabled :cry:"
+			elif selection == "addchannel":
+				channel = self.get_channel(ctx, changes)
+				if channel.id not in nsfw["channels"]:
+					nsfw["channels"].append(channel.id)
+					message = "'{}' has been added to the nsfw channel list.".format(channel.name)
+				else:
+					message = "'{}' is already in the list.".format(channel.name)
+			elif selection == "removechannel":
+				channel = self.get_channel(ctx, changes)
+				try:
+					nsfw["channels"].remove(channel.id)
+					message = "'{}' has been removed from the nsfw channel list.".format(channel.name)
+				except ValueError:
+					message = "That role was not in the list."
+			elif selection == "addbadtag":
+				if changes not in nsfw["blacklist"]:
+					nsfw["blacklist"].append(changes)
+					message = "'{}' has been added to the blacklisted tag list.".format(changes)
+				else:
+					message = "'{}' is already in the list.".format(changes)
+			elif selection == "removebadtag":
+				try:
+					nsfw["blacklist"].remove(changes)
+					message = "'{}' has been removed from the blacklisted tag list.".format(changes)
+				except ValueError:
+					message = "That tag was not in the blacklisted tag list."
 			else:
-				return await ctx.send("'{}' is already in the list.".format(changes))
-		elif selection == "removebadtag":
-			try:
-				nsfw["blacklist"].remove(changes)
-				await ctx.send("'{}' has been removed from the blacklisted tag list.".format(changes))
-			except ValueError:
-				return await ctx.send("That tag was not in the blacklisted tag list.")
-		else:
-			return await ctx.send("No valid option given.")
-		return self.guild_settings.update(nsfw, "nsfw")
+				message = "No valid option given."
+			settings.update(nsfw, "nsfw")
+		return await ctx.send(message)
 
 	@settings.command()
 	async def voice(self, ctx, setting=None, change=None):
@@ -567,64 +620,67 @@ class Settings:
 		Example:
 			;settings voice enable skipvoting
 		"""
-		setting = setting.lower()
-		change = change.lower()
-		voice = self.guild_settings.voice
-
-		if setting == "enable":
-			if change == "needperms":
-				voice["need_perms"] = 1
-				await ctx.send("'{}' has been enabled!".format(change))
-			elif change == "skipvoting":
-				voice["skip_voting"] = 1
-				await ctx.send("'{}' has been enabled!".format(change))
-			else:
-				return await ctx.send("Not a valid change.")
-		elif setting == "disable":
-			if change == "needperms":
-				voice["need_perms"] = 1
-				await ctx.send("'{}' was disabled :cry:".format(change))
-			elif change == "skipvoting":
-				voice["skip_voting"] = 1
-				await ctx.send("'{}' was disabled :cry:".format(change))
-			else:
-				return await ctx.send("Not a valid change.")
-		elif setting == "skipratio":
-			change = float(change)
-			if 1 > change > 0:
-				voice["skip_ratio"] = change
-			elif 0 < change <= 100:
-				change = change/10
-				voice["skip_ratio"] = change
-			else:
-				return await ctx.send("Valid ratio not given.")
-			await ctx.send("Skip Ratio was set to {}".format(change))
-		elif setting == "maxlength" or setting == "maxduration":
-			change = int(change)
-			if change >= 1:
-				voice["skip_ratio"] = change
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			setting = setting.lower()
+			change = change.lower()
+			voice = settings.voice
+
+			if setting == "enable":
+				if change == "needperms":
+					voice["need_perms"] = 1
+					message = "'{}' has been enabled!".format(change)
+				elif change == "skipvoting":
+					voice["skip_voting"] = 1
+					message = "'{}' has been enabled!".format(change)
+				else:
+					message = "Not a valid change."
+			elif setting == "disable":
+				if change == "needperms":
+					voice["need_perms"] = 1
+					message = "'{}' was disabled :cry:".format(change)
+				elif change == "skipvoting":
+					voice["skip_voting"] = 1
+					message = "'{}' was disabled :cry:".format(change)
+				else:
+					message = "Not a valid change."
+			elif setting == "skipratio":
+				change = float(change)
+				if 1 > change > 0:
+					voice["skip_ratio"] = change
+					message = "Skip Ratio was set to {}".format(change)
+				elif 0 < change <= 100:
+					change = change/10
+					voice["skip_ratio"] = change
+					message = "Skip Ratio was set to {}".format(change)
+				else:
+					message = "Valid ratio not given."
+			elif setting == "maxlength" or setting == "maxduration":
+				change = int(change)
+				if change >= 1:
+					voice["skip_ratio"] = change
+					message = "Max Duration was set to {}".format(change)
+				else:
+					message = "Valid max duration not given."
 			else:
-				return await ctx.send("Valid max duration not given.")
-			await ctx.send("Max Duration was set to {}".format(change))
-		else:
-			return await ctx.send("Valid option not given.")
-		return self.guild_settings.update(voice, "voice")
+				message = "Valid option not given."
+			settings.update(voice, "voice")
+		return await ctx.send(message)
 
 	@checks.is_admin_or_mod()
 	@commands.command()
 	async def serverisanal(self, ctx):
 		"""Tells the bot where the server is anal or not.
 		This only changes if roxbot can do the suck and spank commands outside of the specified nsfw channels."""
-		is_anal = self.guild_settings.is_anal
-		if is_anal["y/n"] == 0:
-			is_anal["y/n"] = 1
-			self.guild_settings.update(is_anal, "is_anal")
-			await ctx.send("I now know this server is anal")
-		else:
-			is_anal["y/n"] = 0
-			self.guild_settings.update(is_anal, "is_anal")
-			await ctx.send("I now know this server is NOT anal")
-		return self.guild_settings.update()
+		async with guild_settings.get(ctx.guild).transaction() as settings:
+			is_anal = settings.is_anal
+			if is_anal["y/n"] == 0:
+				is_anal["y/n"] = 1
+				message = "I now know this server is anal"
+			else:
+				is_anal["y/n"] = 0
+				message = "I now know this server is NOT anal"
+			settings.update(is_anal, "is_anal")
+		await ctx.send(message)
 
 
 def setup(bot_client):
@@ -0,0 +1,126 @@
+import os
+import json
+import sqlite3
+
+
+class JSONBackend:
+	"""
+	Stores every guild's settings in one JSON file. This is how roxbot has always saved settings.
+	Any change means rewriting the whole file, so it is written to a temp file first and swapped in to avoid a crash leaving half a file behind.
+	"""
+	def __init__(self, path="roxbot/settings/servers.json"):
+		self.path = path
+
+	def load(self):
+		"""
+		Opens the guild settings file
+		:return settings file and metadata: :type tuple(dict, dict):
+		"""
+		with open(self.path, 'r') as config_file:
+			config = json.load(config_file)
+		# Guild IDs are always numbers so "_meta" can't clash with a guild.
+		meta = config.pop("_meta", {})
+		return config, meta
+
+	def save(self, config, changed, removed, meta):
+		"""
+		Writes given config to disk.
+		:param config: Every guild's settings :type dict:
+		:param changed: Not used, the whole file is always written.
+		:param removed: Not used, the whole file is always written.
+		:param meta: Metadata about the settings, like the schema version. :type dict:
+		"""
+		temp = self.path + ".tmp"
+		with open(temp, 'w') as conf_file:
+			json.dump(dict(config, _meta=meta), conf_file)
+			conf_file.flush()
+			os.fsync(conf_file.fileno())
+		os.replace(temp, self.path)
+
+
+class SQLiteBackend:
+	"""
+	Stores settings in SQLite with one row per section of each guild.
+	Saving only touches the sections that changed and all of them are written in one transaction, so a crash can't corrupt any other guild's settings.
+	"""
+	def __init__(self, path="roxbot/settings/servers.db"):
+		self.path = path
+		self.conn = sqlite3.connect(path)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS guild_settings (guild_id TEXT, section TEXT, value TEXT, PRIMARY KEY (guild_id, section))")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+		self.conn.commit()
+
+	def is_empty(self):
+		return self.conn.execute("SELECT 1 FROM guild_settings LIMIT 1").fetchone() is None
+
+	def load(self):
+		config = {}
+		for guild_id, section, value in self.conn.execute("SELECT guild_id, section, value FROM guild_settings"):
+			config.setdefault(guild_id, {})[section] = json.loads(value)
+		meta = {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")}
+		return config, meta
+
+	def save(self, config, changed, removed, meta):
+		"""
+		Writes the changed sections and deletes removed guilds in a single transaction.
+		:param config: Every guild's settings, only used to look up the changed sections. :type dict:
+		:param changed: Dict of guild ids to the names of the sections that changed. :type dict:
+		:param removed: Guild ids that should be deleted. :type set:
+		:param meta: Metadata about the settings, like the schema version. :type dict:
+		"""
+		with self.conn:
+			for guild_id in removed:
+				self.conn.execute("DELETE FROM guild_settings WHERE guild_id = ?", (guild_id,))
+			rows = []
+			for guild_id, sections in changed.items():
+				for section in sections:
+					rows.append((guild_id, section, json.dumps(config[guild_id][section])))
+			self.conn.executemany("INSERT OR REPLACE INTO guild_settings (guild_id, section, value) VALUES (?, ?, ?)", rows)
+			self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(key, json.dumps(value)) for key, value in meta.items()])
+
+	def close(self):
+		self.conn.close()
+
+
+def _save_all(backend, config, meta):
+	backend.save(config, {guild_id: list(settings) for guild_id, settings in config.items()}, set(), meta)
+
+
+def migrate_json_to_sqlite(json_path="roxbot/settings/servers.json", db_path="roxbot/settings/servers.db"):
+	"""
+	One-shot migration of the JSON settings file into a SQLite database. The JSON file is left alone so it can still be used as a backup.
+	:param json_path:
+	:param db_path:
+	:return Amount of guilds migrated: :type int:
+	"""
+	config, meta = JSONBackend(json_path).load()
+	backend = SQLiteBackend(db_path)
+	_save_all(backend, config, meta)
+	backend.close()
+	return len(config)
+
+
+def get_backend(name):
+	"""
+	Returns the storage backend for the name given in the preferences file.
+	If SQLite is picked and the database is empty, the JSON settings file is migrated into it first.
+	:param name: "json" or "sqlite"
+	:return backend:
+	"""
+	name = name.lower()
+	if name == "json":
+		return JSONBackend()
+	elif name == "sqlite":
+		backend = SQLiteBackend()
+		if backend.is_empty() and os.path.isfile("roxbot/settings/servers.json"):
+			config, meta = JSONBackend().load()
+			_save_all(backend, config, meta)
+			print("Migrated {} guild(s) from servers.json to SQLite.".format(len(config)))
+		return backend
+	else:
+		raise ValueError("Unknown settings backend '{}'. Use 'json' or 'sqlite'.".format(name))
+
+
+if __name__ == "__main__":
+	print("Migrated {} guild(s) to SQLite.".format(migrate_json_to_sqlite()))
@@ -23,7 +23,6 @@ class System:
 		OWNER OR ADMIN ONLY
 		"""
 		# TODO: Make this better instead of relying on mentions
-		blacklist_amount = 0
 		mentions = ctx.message.mentions
 
 		if not mentions:
@@ -39,32 +38,12 @@ class System:
 				mentions.remove(user)
 
 		if option in ['+', 'add']:
-			with open("roxbot/blacklist.txt", "r") as fp:
-				for user in mentions:
-					for line in fp.readlines():
-						if user.id + "\n" in line:
-							mentions.remove(user)
-
-			with open("roxbot/blacklist.txt", "a+") as fp:
-				lines = fp.readlines()
-				for user in mentions:
-					if user.id not in lines:
-						fp.write("{}\n".format(user.id))
-						blacklist_amount += 1
+			blacklist_amount = roxbot.utils.blacklist.add(*[user.id for user in mentions])
 			return await ctx.send('{} user(s) have been added to the blacklist'.format(blacklist_amount))
 
 		elif option in ['-', 'remove']:
-			with open("roxbot/blacklist.txt", "r") as fp:
-				lines = fp.readlines()
-			with open("roxbot/blacklist.txt", "w") as fp:
-				for user in mentions:
-					for line in lines:
-						if str(user.id) + "\n" != line:
-							fp.write(line)
-						else:
-							fp.write("")
-							blacklist_amount += 1
-				return await ctx.send('{} user(s) have been removed from the blacklist'.format(blacklist_amount))
+			blacklist_amount = roxbot.utils.blacklist.remove(*[user.id for user in mentions])
+			return await ctx.send('{} user(s) have been removed from the blacklist'.format(blacklist_amount))
 
 	@commands.command(aliases=["setavatar"])
 	@commands.is_owner()
@@ -75,16 +54,13 @@ class System:
 			;changeavatar [url]
 		Attaching a file and leaving the url parameter blank also works.
 		"""
-		avaimg = 'avaimg'
 		if ctx.message.attachments:
-			await ctx.message.attachments[0].save(avaimg)
+			url = ctx.message.attachments[0].url
 		else:
 			url = url.strip('<>')
-			roxbot.http.download_file(url, avaimg)
-		with open(avaimg, 'rb') as f:
-			await self.bot.user.edit(avatar=f.read())
-		os.remove(avaimg)
-		asyncio.sleep(2)
+		avaimg = await roxbot.http.download_bytes(url)
+		await self.bot.user.edit(avatar=avaimg.getvalue())
+		await asyncio.sleep(2)
 		return await ctx.send(":ok_hand:")
 
 	@commands.command(aliases=["nick", "nickname"])
@@ -128,12 +104,72 @@ class System:
 		await self.bot.change_presence(status=discord_status)
 		await ctx.send("**:ok:** Status set to {}".format(discord_status))
 
+	@commands.command()
+	@commands.is_owner()
+	async def httpstats(self, ctx, host=None):
+		"""
+		Shows how the APIs roxbot uses are performing since it started.
+		Usage:
+			;httpstats - Every host
+			;httpstats [host] - Each endpoint of that host, like ;httpstats reddit.com
+			;httpstats dump - Sends all the stats as a JSON file
+		"""
+		if host == "dump":
+			filename = roxbot.http.dump_stats()
+			return await ctx.send(file=discord.File(filename))
+
+		def ms(seconds):
+			if seconds is None:
+				return "-"
+			elif seconds == float("inf"):
+				return ">{}s".format(roxbot.http.LATENCY_BUCKETS[-1])
+			return "{:.0f}ms".format(seconds * 1000)
+
+		def line(name, stats):
+			latency = stats["latency"]
+			statuses = ", ".join("{}: {}".format(status, count) for status, count in sorted(stats["statuses"].items()))
+			cache = ", ".join("{}: {}".format(result, count) for result, count in sorted(stats["cache"].items()))
+			return "{}\n  {} requests ({} in flight), avg {}, p50 {}, p95 {}, {:.1f}s waiting, {:.1f}KB\n  {}\n  {}\n".format(
+				name, stats["requests"], stats["in_flight"], ms(latency["average"]), ms(latency["p50"]), ms(latency["p95"]),
+				stats["waiting"], stats["bytes"] / 1024, statuses or "-", cache or "-")
+
+		stats = roxbot.http.stats(host)
+		if not stats:
+			return await ctx.send("No requests have been made{}.".format(" to " + host if host else ""))
+		output = ""
+		for name, host_stats in sorted(stats.items()):
+			if host is None:
+				output += line(name, host_stats)
+			else:
+				for endpoint, endpoint_stats in sorted(host_stats["endpoints"].items()):
+					output += line(endpoint, endpoint_stats)
+		if len(output) > 1900:
+			output = output[:1900] + "\n...use ;httpstats dump for the rest."
+		return await ctx.send("```\n{}```".format(output))
+
+	@commands.command()
+	@commands.is_owner()
+	async def pipelinestats(self, ctx):
+		"""
+		Shows how long each stage that messages go through has taken since roxbot started, in the order they run.
+		Usage:
+			;pipelinestats
+		"""
+		stats = roxbot.pipeline.stats()
+		if not stats:
+			return await ctx.send("No messages have been through the pipeline yet.")
+		output = ""
+		for name, calls, average, slowest in stats:
+			output += "{}\n  {} calls, avg {:.2f}ms, slowest {:.2f}ms\n".format(name, calls, average, slowest)
+		return await ctx.send("```\n{}```".format(output[:1900]))
+
 	# TODO: Fix these two commands.
 
 	@commands.command()
 	@commands.is_owner()
 	async def restart(self, ctx):
 		"""Restarts the bot."""
+		roxbot.guild_settings.flush()  # os.execl skips atexit so save any waiting settings changes first.
 		await self.bot.logout()
 		return os.execl(sys.executable, sys.executable, *sys.argv)
 
@@ -141,6 +177,7 @@ class System:
 	@commands.is_owner()
 	async def shutdown(self, ctx):
 		"""Shuts down the bot."""
+		roxbot.guild_settings.flush()
 		await self.bot.logout()
 		return exit(0)
 
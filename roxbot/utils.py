@@ -1,3 +1,5 @@
+import os
+import time
 from asyncio import TimeoutError
 
 
@@ -18,9 +20,89 @@ async def delete_option(bot, ctx, message, delete_emoji, timeout=20):
 		await message.remove_reaction(delete_emoji, bot.user)
 
 
+class Blacklist:
+	"""
+	The IDs of blacklisted users, kept in memory as a set so checking a user is a set lookup and not a file read.
+	The IDs are saved in roxbot/settings/blacklist.txt, one per line. If that file is edited by hand the changes are picked up,
+	but its mtime is only checked every CHECK_INTERVAL seconds so most checks don't touch the disk at all.
+	"""
+	CHECK_INTERVAL = 30
+
+	def __init__(self, path="roxbot/settings/blacklist.txt"):
+		self.path = path
+		self.ids = set()
+		self._mtime = None
+		self._checked = None
+
+	def _mtime_now(self):
+		try:
+			return os.stat(self.path).st_mtime
+		except FileNotFoundError:
+			return None
+
+	def _refresh(self):
+		now = time.monotonic()
+		if self._checked is not None and now - self._checked < self.CHECK_INTERVAL:
+			return
+		self._checked = now
+		mtime = self._mtime_now()
+		if mtime != self._mtime:
+			self.load()
+
+	def load(self):
+		ids = set()
+		try:
+			with open(self.path, "r") as fp:
+				for line in fp:
+					if line.strip().isdigit():
+						ids.add(int(line))
+		except FileNotFoundError:
+			pass
+		self.ids = ids
+		self._mtime = self._mtime_now()
+		self._checked = time.monotonic()
+
+	def _save(self):
+		# Write to a temp file and swap it in so the blacklist is never left half written.
+		temp = self.path + ".tmp"
+		with open(temp, "w") as fp:
+			fp.writelines("{}\n".format(user_id) for user_id in sorted(self.ids))
+		os.replace(temp, self.path)
+		self._mtime = self._mtime_now()
+
+	def __contains__(self, user_id):
+		self._refresh()
+		return user_id in self.ids
+
+	def add(self, *user_ids):
+		"""
+		Adds users to the blacklist and saves it.
+		:param user_ids: IDs of the users :type int:
+		:return amount of users that weren't already blacklisted: :type int:
+		"""
+		self._refresh()
+		new = set(user_ids) - self.ids
+		if new:
+			self.ids.update(new)
+			self._save()
+		return len(new)
+
+	def remove(self, *user_ids):
+		"""
+		Removes users from the blacklist and saves it.
+		:param user_ids: IDs of the users :type int:
+		:return amount of users that were removed: :type int:
+		"""
+		self._refresh()
+		removed = set(user_ids) & self.ids
+		if removed:
+			self.ids.difference_update(removed)
+			self._save()
+		return len(removed)
+
+
+blacklist = Blacklist()
+
+
 def blacklisted(user):
-	with open("roxbot/settings/blacklist.txt", "r") as fp:
-		for line in fp.readlines():
-			if str(user.id)+"\n" == line:
-				return True
-	return False
+	return user.id in blacklist